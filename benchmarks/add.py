@@ -0,0 +1,54 @@
+"""Compare single-track and batched bulk insert throughput.
+
+Usage: python benchmarks/add.py [NUM_TRACKS [BATCH_SIZE]]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from suite import generate_tracks
+
+from mopidy_local_sqlite import schema
+
+
+def run(path, tracks, batch_size):
+    connection = sqlite3.connect(path, factory=schema.Connection)
+    try:
+        schema.load(connection)
+        start = time.time()
+        if batch_size:
+            schema.begin_bulk(connection)
+            for i in range(0, len(tracks), batch_size):
+                schema.insert_tracks(connection, tracks[i:i + batch_size])
+            schema.end_bulk(connection)
+        else:
+            for track in tracks:
+                schema.insert_track(connection, track)
+        connection.commit()
+        return time.time() - start
+    finally:
+        connection.close()
+
+
+def main(count=10000, batch_size=1000):
+    tracks = list(generate_tracks(count))
+    tempdir = tempfile.mkdtemp()
+    try:
+        for name, size in (('single', None), ('batch', batch_size)):
+            path = os.path.join(tempdir, '%s.db' % name)
+            elapsed = run(path, tracks, size)
+            print('%-8s %8d tracks %8.2fs %10.1f tracks/s' % (
+                name, count, elapsed, count / elapsed
+            ))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
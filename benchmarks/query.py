@@ -0,0 +1,84 @@
+"""Measure lookup, search and browse latency on a synthetic library.
+
+Usage: python benchmarks/query.py [NUM_TRACKS [REPEAT]]
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from mopidy.models import Ref
+
+from suite import generate_tracks
+
+from mopidy_local_sqlite import schema
+
+
+def build(path, tracks, batch_size=1000):
+    connection = sqlite3.connect(path, factory=schema.Connection)
+    schema.load(connection)
+    schema.begin_bulk(connection)
+    for i in range(0, len(tracks), batch_size):
+        schema.insert_tracks(connection, tracks[i:i + batch_size])
+    schema.end_bulk(connection)
+    connection.commit()
+    return connection
+
+
+def queries(connection, tracks):
+    track = random.choice(tracks)
+    artist = max(track.artists, key=lambda artist: artist.uri)
+    return [
+        ('lookup track', lambda: list(schema.lookup(
+            connection, Ref.TRACK, track.uri
+        ))),
+        ('lookup album', lambda: list(schema.lookup(
+            connection, Ref.ALBUM, track.album.uri
+        ))),
+        ('search exact', lambda: schema.search_tracks(
+            connection, [('artist', artist.name)], 100, 0, True
+        )),
+        ('search fulltext', lambda: schema.search_tracks(
+            connection, [('any', artist.name)], 100, 0, False
+        )),
+        ('browse albums', lambda: schema.browse(
+            connection, Ref.ALBUM, artist=artist.uri
+        )),
+    ]
+
+
+def run(connection, tracks, repeat):
+    timings = {}
+    for _ in range(repeat):
+        for name, query in queries(connection, tracks):
+            start = time.time()
+            query()
+            timings.setdefault(name, []).append(time.time() - start)
+    return timings
+
+
+def main(count=10000, repeat=100):
+    # query the same tracks and artists in every run
+    random.seed(0)
+    tracks = list(generate_tracks(count))
+    tempdir = tempfile.mkdtemp()
+    try:
+        connection = build(os.path.join(tempdir, 'library.db'), tracks)
+        for name, times in sorted(run(connection, tracks, repeat).items()):
+            times.sort()
+            print('%-16s %8d tracks %8.3fms median %8.3fms max' % (
+                name, count, times[len(times) // 2] * 1000, times[-1] * 1000
+            ))
+        connection.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,261 @@
+"""Benchmark SQLiteLibrary operations on synthetic libraries.
+
+Usage: python benchmarks/suite.py [-o REPORT] [-r REPEAT] [NUM_TRACKS...]
+
+Libraries of 10000, 100000 and 1000000 tracks are generated by
+default, with artist, album, genre and release year frequencies
+following a skewed distribution.  Results are written as JSON to
+REPORT, or to standard output if not given.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import bisect
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from mopidy.compat import configparser
+from mopidy.models import Album, Artist, Track
+
+from mopidy_local_sqlite import Extension, library
+
+SIZES = (10000, 100000, 1000000)
+
+# exponent of the Zipf-like distributions used for generated metadata
+SKEW = 1.1
+
+GENRES = (
+    'Rock', 'Pop', 'Jazz', 'Classical', 'Electronic', 'Hip Hop', 'Blues',
+    'Folk', 'Country', 'Metal', 'Reggae', 'Soul', 'Punk', 'Funk', 'Ambient',
+    'Soundtrack', 'Latin', 'World', 'Gospel', 'Disco'
+)
+
+WORDS = (
+    'love', 'night', 'blue', 'heart', 'river', 'fire', 'light', 'dream',
+    'city', 'rain', 'moon', 'road', 'home', 'time', 'gold', 'storm',
+    'summer', 'shadow', 'dance', 'world', 'stone', 'sky', 'ocean', 'wild'
+)
+
+
+class Zipf(object):
+
+    def __init__(self, n, skew=SKEW):
+        total = 0.0
+        self._weights = []
+        for k in range(1, n + 1):
+            total += 1.0 / k ** skew
+            self._weights.append(total)
+
+    def __call__(self, random):
+        x = random.random() * self._weights[-1]
+        return bisect.bisect_left(self._weights, x)
+
+
+def _name(random, n):
+    return ' '.join(random.choice(WORDS).title() for _ in range(n))
+
+
+def generate_tracks(count, seed=0):
+    rnd = random.Random(seed)
+    num_artists = max(count // 40, 1)
+    artists = [Artist(
+        uri='local:artist:%d' % i,
+        name='%s %d' % (_name(rnd, 2), i)
+    ) for i in range(num_artists)]
+    various = Artist(uri='local:artist:various', name='Various Artists')
+    pick_artist = Zipf(num_artists)
+    pick_genre = Zipf(len(GENRES))
+    pick_year = Zipf(70)
+    i = 0
+    while i < count:
+        n = rnd.randint(8, 16)
+        artist = artists[pick_artist(rnd)]
+        # every tenth album is a compilation
+        compilation = rnd.random() < 0.1
+        album = Album(
+            uri='local:album:%d' % i,
+            name='%s %d' % (_name(rnd, 3), i),
+            artists=[various if compilation else artist],
+            num_tracks=n,
+            date='%d' % (2019 - pick_year(rnd))
+        )
+        genre = GENRES[pick_genre(rnd)]
+        for track_no in range(1, min(n, count - i) + 1):
+            if compilation:
+                artist = artists[pick_artist(rnd)]
+            track_artists = [artist]
+            if rnd.random() < 0.1:
+                track_artists.append(artists[pick_artist(rnd)])
+            composers = []
+            if genre == 'Classical' or rnd.random() < 0.2:
+                composers.append(artists[pick_artist(rnd)])
+            yield Track(
+                uri='local:track:%d.mp3' % i,
+                name=_name(rnd, rnd.randint(1, 4)),
+                album=album,
+                artists=track_artists,
+                composers=composers,
+                genre=genre,
+                track_no=track_no,
+                date=album.date,
+                length=rnd.randint(60000, 600000),
+                last_modified=i
+            )
+            i += 1
+
+
+def default_config():
+    parser = configparser.RawConfigParser()
+    parser.read(os.path.join(os.path.dirname(library.__file__), 'ext.conf'))
+    schema = Extension().get_config_schema()
+    config, errors = schema.deserialize(dict(parser.items(schema.name)))
+    if errors:
+        raise ValueError(errors)
+    # measure actual queries, not the result cache
+    config['result_cache_size'] = 0
+    config['slow_query_threshold'] = None
+    return config
+
+
+def timeit(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append((time.time() - start) * 1000)
+    times.sort()
+    return {
+        'repeat': repeat,
+        'min_ms': times[0],
+        'median_ms': times[len(times) // 2],
+        'p95_ms': times[min(len(times) * 95 // 100, len(times) - 1)],
+        'max_ms': times[-1]
+    }
+
+
+def operations(lib, config, tracks):
+    track = tracks[len(tracks) // 2]
+    artist = next(iter(track.artists))
+    word = track.name.split()[0]
+    ops = [('browse root', lambda: lib.browse(lib.ROOT_DIRECTORY_URI))]
+    for line in config['directories']:
+        name, uri = line.rsplit(None, 1)
+        ops.append(('browse %s' % name, lambda uri=uri: lib.browse(uri)))
+    ops.extend([
+        ('lookup track', lambda: lib.lookup(track.uri)),
+        ('lookup album', lambda: lib.lookup(track.album.uri)),
+        ('lookup artist', lambda: lib.lookup(artist.uri)),
+        ('search exact artist', lambda: lib.search(
+            {'artist': [artist.name]}, exact=True
+        )),
+        ('search exact album', lambda: lib.search(
+            {'album': [track.album.name]}, exact=True
+        )),
+        ('search exact any', lambda: lib.search(
+            {'any': [artist.name]}, exact=True
+        )),
+        ('search any', lambda: lib.search({'any': [word]})),
+        ('search artist genre', lambda: lib.search(
+            {'artist': [artist.name.split()[0]], 'genre': [track.genre]}
+        )),
+    ])
+    for field in ('artist', 'albumartist', 'album', 'genre', 'date'):
+        ops.append(('get_distinct %s' % field, lambda field=field: (
+            lib.get_distinct(field)
+        )))
+    ops.append(('get_distinct album by artist', lambda: lib.get_distinct(
+        'album', {'artist': [artist.name]}
+    )))
+    return ops
+
+
+def run(count, repeat, tempdir):
+    config = default_config()
+    mopidy_config = {
+        'core': {'data_dir': tempdir},
+        'local': {'media_dir': tempdir},
+        Extension.ext_name: config
+    }
+    lib = library.SQLiteLibrary(mopidy_config)
+    lib.load()
+    tracks = list(generate_tracks(count))
+    results = {}
+
+    lib.begin()
+    start = time.time()
+    for track in tracks:
+        lib.add(track)
+    lib.flush()
+    elapsed = time.time() - start
+    results['add'] = {
+        'tracks_per_s': count / elapsed,
+        'total_ms': elapsed * 1000
+    }
+    start = time.time()
+    lib.close()
+    results['close'] = {'total_ms': (time.time() - start) * 1000}
+
+    # keep a sample of tracks only to bound memory usage
+    sample = tracks[::max(len(tracks) // 1000, 1)]
+    del tracks
+    for name, func in operations(lib, config, sample):
+        results[name] = timeit(func, repeat)
+
+    # close after rescanning a small part of the library
+    lib.begin()
+    for track in sample[:100]:
+        lib.add(track.replace(last_modified=track.last_modified + 1))
+    lib.flush()
+    start = time.time()
+    lib.close()
+    results['close after update'] = {
+        'total_ms': (time.time() - start) * 1000
+    }
+    data_dir = Extension.get_or_create_data_dir(mopidy_config)
+    results['database'] = {
+        'bytes': os.path.getsize(os.path.join(data_dir, b'library.db'))
+    }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', help='write JSON report to file')
+    parser.add_argument('-r', '--repeat', type=int, default=20,
+                        help='number of repetitions per query')
+    parser.add_argument('sizes', metavar='NUM_TRACKS', type=int, nargs='*',
+                        default=SIZES, help='library sizes to generate')
+    args = parser.parse_args(argv)
+
+    report = {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'timestamp': int(time.time()),
+        'results': {}
+    }
+    for count in args.sizes:
+        tempdir = tempfile.mkdtemp()
+        try:
+            print('Benchmarking %d tracks...' % count, file=sys.stderr)
+            report['results'][str(count)] = run(count, args.repeat, tempdir)
+        finally:
+            shutil.rmtree(tempdir)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,25 @@ class Extension(ext.Extension):
         schema = super(Extension, self).get_config_schema()
         schema['directories'] = config.List()
         schema['timeout'] = config.Integer(optional=True, minimum=1)
+        schema['pool_size'] = config.Integer(minimum=1)
+        schema['batch_size'] = config.Integer(minimum=1)
+        schema['journal_mode'] = config.String(optional=True, choices=[
+            'delete', 'truncate', 'persist', 'memory', 'wal', 'off'
+        ])
+        schema['synchronous'] = config.String(optional=True, choices=[
+            'off', 'normal', 'full', 'extra'
+        ])
+        schema['cache_size'] = config.Integer(optional=True)
+        schema['mmap_size'] = config.Integer(optional=True, minimum=0)
+        schema['temp_store'] = config.String(optional=True, choices=[
+            'default', 'file', 'memory'
+        ])
+        schema['wal_autocheckpoint'] = config.Integer(optional=True, minimum=0)
+        schema['model_cache_size'] = config.Integer(minimum=0)
+        schema['result_cache_size'] = config.Integer(minimum=0)
+        schema['slow_query_threshold'] = config.Integer(
+            optional=True, minimum=0
+        )
         schema['use_album_mbid_uri'] = config.Boolean()
         schema['use_artist_mbid_uri'] = config.Boolean()
         schema['use_artist_sortname'] = config.Boolean()
@@ -1,8 +1,9 @@
 from __future__ import unicode_literals
 
+import functools
 import hashlib
+import heapq
 import logging
-import operator
 import os
 import os.path
 import sqlite3
@@ -15,11 +16,44 @@ from mopidy.models import Ref, SearchResult
 
 import uritools
 
-from . import Extension, schema
+from . import Extension, cache, pool, schema, stats
+
+_PRAGMAS = (
+    'journal_mode',
+    'synchronous',
+    'cache_size',
+    'mmap_size',
+    'temp_store',
+    'wal_autocheckpoint'
+)
+
+_READER_PRAGMAS = (
+    'cache_size',
+    'mmap_size',
+    'temp_store'
+)
+
+# number of SQLite virtual machine instructions per counted step
+_PROGRESS_STEPS = 1000
 
 logger = logging.getLogger(__name__)
 
 
+def _timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self._stats.measure(name) as sample:
+                result = func(self, *args, **kwargs)
+                sample.rows = _count(result)
+            threshold = self._config['slow_query_threshold']
+            if threshold is not None and sample.ms >= threshold:
+                self._log_slow_query(name, args, sample)
+            return result
+        return wrapper
+    return decorator
+
+
 class SQLiteLibrary(local.Library):
 
     name = 'sqlite'
@@ -38,24 +72,62 @@ class SQLiteLibrary(local.Library):
             self._directories.append(ref)
         self._dbpath = os.path.join(self._data_dir, b'library.db')
         self._connection = None
+        self._transaction = False
+        self._readers = pool.ConnectionPool(
+            self._open_reader, ext_config['pool_size']
+        )
+        self._batch = []
+        self._bulk = False
+        self._changes = 0
+        if ext_config['model_cache_size']:
+            self._models = cache.LRUCache(ext_config['model_cache_size'])
+        else:
+            self._models = None
+        if ext_config['result_cache_size']:
+            self._results = cache.LRUCache(ext_config['result_cache_size'])
+        else:
+            self._results = None
+        self._generation = 0
+        self._data_versions = {}
+        self._stats = stats.Stats()
 
     def load(self):
-        with self._connect() as connection:
-            version = schema.load(connection)
-            logger.debug('Using SQLite database schema v%s', version)
-            return schema.count_tracks(connection)
-
+        connection = self._connect()
+        version = schema.load(connection)
+        logger.debug('Using SQLite database schema v%s', version)
+        # a scan interrupted before close() leaves triggers disabled
+        if not self._bulk and schema.in_bulk(connection):
+            logger.info('Finishing interrupted SQLite library update')
+            schema.end_bulk(self._begin())
+            self._commit()
+        return schema.count_tracks(connection)
+
+    @_timed('lookup')
     def lookup(self, uri):
-        if uri.startswith('local:album'):
-            return list(schema.lookup(self._connect(), Ref.ALBUM, uri))
-        elif uri.startswith('local:artist'):
-            return list(schema.lookup(self._connect(), Ref.ARTIST, uri))
-        elif uri.startswith('local:track'):
-            return list(schema.lookup(self._connect(), Ref.TRACK, uri))
-        else:
+        type = _lookup_type(uri)
+        if type is None:
             logger.error('Invalid lookup URI %s', uri)
             return []
-
+        with self._reader() as c:
+            return list(schema.lookup(c, type, uri, self._model_cache(c)))
+
+    @_timed('lookup_many')
+    def lookup_many(self, uris):
+        result, groups = {}, {}
+        for uri in uris:
+            type = _lookup_type(uri)
+            if type is None:
+                logger.error('Invalid lookup URI %s', uri)
+                result[uri] = []
+            else:
+                groups.setdefault(type, []).append(uri)
+        with self._reader() as c:
+            cache = self._model_cache(c)
+            for type, group in groups.items():
+                result.update(schema.lookup_many(c, type, group, cache))
+        return result
+
+    @_timed('browse')
     def browse(self, uri):
         try:
             if uri == self.ROOT_DIRECTORY_URI:
@@ -72,76 +144,226 @@ class SQLiteLibrary(local.Library):
             logger.error('Error browsing %s: %s', uri, e)
             return []
 
+    @_timed('search')
     def search(self, query=None, limit=100, offset=0, uris=None, exact=False):
         q = []
         for field, values in (query.items() if query else []):
             q.extend((field, value) for value in values)
-        filters = [f for uri in uris or [] for f in self._filters(uri) if f]
-        with self._connect() as c:
-            tracks = schema.search_tracks(c, q, limit, offset, exact, filters)
-        uri = uritools.uricompose('local', path='search', query=q)
-        return SearchResult(uri=uri, tracks=tracks)
-
+        if uris is not None:
+            uris = tuple(uris)
+        key = ('search', tuple(sorted(q)), limit, offset, exact, uris)
+        with self._reader() as c:
+            return self._cached(c, key, self._search, c, q, limit, offset,
+                                uris, exact)
+
+    @_timed('get_distinct')
     def get_distinct(self, field, query=None):
         q = []
         for key, values in (query.items() if query else []):
             q.extend((key, value) for value in values)
-        return set(schema.list_distinct(self._connect(), field, q))
+        key = ('get_distinct', field, tuple(sorted(q)))
+        with self._reader() as c:
+            return set(self._cached(c, key, self._get_distinct, c, field, q))
+
+    def cache_info(self):
+        return {
+            name: {'hits': c.hits, 'misses': c.misses, 'size': len(c)}
+            for name, c in (('models', self._models),
+                            ('results', self._results))
+            if c is not None
+        }
+
+    def suggest(self, prefix, limit=10):
+        # names and URIs of matching artists, albums and tracks
+        with self._reader() as c:
+            return schema.suggest(c, prefix, limit)
 
     def begin(self):
-        return schema.tracks(self._connect())
+        # defer full-text index updates until close()
+        schema.begin_bulk(self._begin())
+        self._bulk = True
+        # local scan only needs track URIs and modification times
+        return schema.last_modified(self._connect())
 
+    @_timed('add')
     def add(self, track):
+        self._invalidate()
+        self._changes += 1
         try:
-            track = self._validate_track(track)
-            schema.insert_track(self._connect(), track)
+            self._batch.append(self._validate_track(track))
         except Exception as e:
             logger.warn('Skipped %s: %s', track.uri, e)
+        if len(self._batch) >= self._config['batch_size']:
+            self._insert_batch()
 
+    @_timed('remove')
     def remove(self, uri):
-        schema.delete_track(self._connect(), uri)
+        self._invalidate()
+        self._changes += 1
+        self._insert_batch()
+        schema.delete_track(self._begin(), uri)
 
+    @_timed('flush')
     def flush(self):
+        self._invalidate()
+        self._insert_batch()
         if not self._connection:
             return False
-        self._connection.commit()
+        self._commit()
         return True
 
     def close(self):
-        schema.cleanup(self._connection)
-        self._connection.commit()
+        self._insert_batch()
+        c = self._begin()
+        if self._bulk:
+            schema.end_bulk(c)
+            self._bulk = False
+        with self._stats.measure('cleanup'):
+            schema.cleanup(c)
+        schema.optimize(c, self._changes)
+        self._changes = 0
+        self._commit()
+        schema.checkpoint(self._connection)
         self._connection.close()
         self._connection = None
+        self._close_readers()
+        if len(self._stats):
+            logger.info('SQLite library statistics:\n  %s', '\n  '.join(
+                self._stats_lines()
+            ))
 
     def clear(self):
+        del self._batch[:]
+        self._bulk = False
+        self._changes = 0
+        self._invalidate()
+        # clearing commits pending changes, since VACUUM cannot run
+        # inside a transaction
+        self._transaction = False
         try:
             schema.clear(self._connect())
             return True
         except sqlite3.Error as e:
             logger.error('Error clearing SQLite database: %s', e)
             return False
+        finally:
+            self._close_readers()
 
     def _connect(self):
         if not self._connection:
-            self._connection = sqlite3.connect(
-                self._dbpath,
-                factory=schema.Connection,
-                timeout=self._config['timeout'],
-                check_same_thread=False,
-            )
+            self._connection = self._open(_PRAGMAS)
+            # manage transactions explicitly, so that batch savepoints
+            # nest inside a single transaction committed by flush()
+            self._connection.isolation_level = None
         return self._connection
 
+    def _begin(self):
+        connection = self._connect()
+        if not self._transaction:
+            connection.execute('BEGIN')
+            self._transaction = True
+        return connection
+
+    def _commit(self):
+        if self._transaction:
+            self._connection.commit()
+            self._transaction = False
+
+    def _reader(self):
+        return self._readers.connection()
+
+    def _close_readers(self):
+        # idle readers are reopened on demand
+        self._readers.close()
+        self._data_versions.clear()
+
+    def _open(self, pragmas):
+        connection = sqlite3.connect(
+            self._dbpath,
+            factory=schema.Connection,
+            timeout=self._config['timeout'],
+            check_same_thread=False,
+        )
+        schema.set_pragmas(connection, **{
+            name: self._config[name] for name in pragmas
+            if self._config[name] is not None
+        })
+        return connection
+
+    def _open_reader(self):
+        connection = self._open(_READER_PRAGMAS)
+        schema.set_pragmas(connection, query_only='ON')
+        # count executed statements and VM steps of timed operations
+        connection.set_progress_handler(self._stats.step, _PROGRESS_STEPS)
+        connection.trace = self._stats.trace
+        return connection
+
+    def _invalidate(self):
+        # cached results are keyed on the library generation
+        self._generation += 1
+        if self._models is not None:
+            self._models.clear()
+
+    def _model_cache(self, c):
+        # data version changes when other connections commit, e.g. scans
+        version = schema.data_version(c)
+        if version != self._data_versions.get(c):
+            self._data_versions[c] = version
+            self._invalidate()
+        return self._models
+
+    def _cached(self, c, key, func, *args):
+        self._model_cache(c)
+        if self._results is None:
+            return func(*args)
+        key = (self._generation,) + key
+        result = self._results.get(key)
+        if result is None:
+            result = func(*args)
+            self._results.put(key, result)
+        return result
+
+    def _search(self, c, q, limit, offset, uris, exact):
+        filters = [f for uri in uris or [] for f in self._filters(uri) if f]
+        tracks = schema.search_tracks(
+            c, q, limit, offset, exact, filters, self._model_cache(c)
+        )
+        uri = uritools.uricompose('local', path='search', query=q)
+        return SearchResult(uri=uri, tracks=tracks)
+
+    def _get_distinct(self, c, field, q):
+        return frozenset(schema.list_distinct(c, field, q))
+
+    def _insert_batch(self):
+        if not self._batch:
+            return
+        tracks, self._batch = self._batch, []
+        c = self._begin()
+        try:
+            with schema.savepoint(c):
+                schema.insert_tracks(c, tracks)
+        except Exception as e:
+            logger.debug('Error inserting SQLite batch: %s', e)
+            # fall back to single inserts to skip only the offending tracks
+            for track in tracks:
+                try:
+                    with schema.savepoint(c):
+                        schema.insert_track(c, track)
+                except Exception as e:
+                    logger.warn('Skipped %s: %s', track.uri, e)
+
     def _browse_album(self, uri, order=('disc_no', 'track_no', 'name')):
-        return schema.browse(self._connect(), Ref.TRACK, order, album=uri)
+        with self._reader() as c:
+            return schema.browse(c, Ref.TRACK, order, album=uri)
 
-    def _browse_artist(self, uri, order=('type', 'name COLLATE NOCASE')):
-        with self._connect() as c:
+    def _browse_artist(self, uri, order=('type', 'sortkey')):
+        with self._reader() as c:
             albums = schema.browse(c, Ref.ALBUM, order, albumartist=uri)
             refs = schema.browse(c, order=order, artist=uri)
-        album_uris, tracks = {ref.uri for ref in albums}, []
+        album_uris, others, tracks = {ref.uri for ref in albums}, [], []
         for ref in refs:
             if ref.type == Ref.ALBUM and ref.uri not in album_uris:
-                albums.append(Ref.directory(
+                others.append(Ref.directory(
                     uri=uritools.uricompose('local', None, 'directory', dict(
                         type=Ref.TRACK, album=ref.uri, artist=uri
                     )),
@@ -151,31 +373,58 @@ class SQLiteLibrary(local.Library):
                 tracks.append(ref)
             else:
                 logger.debug('Skipped SQLite browse result %s', ref.uri)
-        albums.sort(key=operator.attrgetter('name'))
-        return albums + tracks
-
-    def _browse_directory(self, uri, order=('type', 'name COLLATE NOCASE')):
+        # both lists are already ordered by sort key
+        albums = heapq.merge(*(
+            ((schema.sortkey(ref.name), ref.uri, ref) for ref in refs)
+            for refs in (albums, others)
+        ))
+        return [ref for _, _, ref in albums] + tracks
+
+    def _browse_directory(self, uri, order=('type', 'sortkey')):
         query = dict(uritools.urisplit(uri).getquerylist())
         type = query.pop('type', None)
         role = query.pop('role', None)
+        limit = query.pop('limit', None)
+        after = query.pop('after', None)
 
         # TODO: handle these in schema (generically)?
+        if type == 'stats':
+            return [Ref.directory(uri=uri, name=line)
+                    for line in self._stats_lines()]
         if type == 'date':
             format = query.get('format', '%Y-%m-%d')
-            return map(_dateref, schema.dates(self._connect(), format=format))
+            with self._reader() as c:
+                return map(_dateref, schema.dates(c, format=format))
         if type == 'genre':
-            return map(_genreref, schema.list_distinct(self._connect(), 'genre'))  # noqa
+            with self._reader() as c:
+                return map(_genreref, schema.genres(c))
 
         # Fix #38: keep sort order of album tracks; this also applies
-        # to composers and performers
+        # to composers and performers; disc and track numbers may be
+        # NULL, which would break keyset pagination
         if type == Ref.TRACK and 'album' in query:
-            order = ('disc_no', 'track_no', 'name')
+            order = ('coalesce(disc_no, 0)', 'coalesce(track_no, 0)', 'name')
         if type == Ref.ARTIST and self._config['use_artist_sortname']:
-            order = ('coalesce(sortname, name) COLLATE NOCASE',)
+            order = ('sortname_key',)
         roles = role or ('artist', 'albumartist')  # FIXME: re-think 'roles'...
 
+        # keyset pagination is only supported for single-type results
+        if limit is not None and type is not None:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError('Invalid limit: %d' % limit)
+            kwargs = dict(query, limit=limit + 1, after=after)
+        else:
+            kwargs, limit = query, None
+        with self._reader() as c:
+            results = schema.browse(c, type, order, role=roles, **kwargs)
+        if limit is not None and len(results) > limit:
+            del results[limit:]
+            after = results[-1].uri
+        else:
+            after = None
         refs = []
-        for ref in schema.browse(self._connect(), type, order, role=roles, **query):  # noqa
+        for ref in results:
             if ref.type == Ref.TRACK or (not query and not role):
                 refs.append(ref)
             elif ref.type == Ref.ALBUM:
@@ -188,8 +437,32 @@ class SQLiteLibrary(local.Library):
                 ), name=ref.name))
             else:
                 logger.warn('Unexpected SQLite browse result: %r', ref)
+        if after is not None:
+            params = dict(query, type=type, limit=limit, after=after)
+            if role:
+                params['role'] = role
+            refs.append(Ref.directory(
+                uri=uritools.uricompose('local', None, 'directory', params),
+                name='More...'
+            ))
         return refs
 
+    def _stats_lines(self):
+        lines = ['%s: %s' % item for item in self._stats]
+        for name, info in sorted(self.cache_info().items()):
+            lines.append('%s cache: %d hits, %d misses, %d items' % (
+                name, info['hits'], info['misses'], info['size']
+            ))
+        return lines
+
+    def _log_slow_query(self, name, args, sample):
+        logger.warn('Slow SQLite %s%r: %.1f ms', name, args, sample.ms)
+        with self._reader() as c:
+            for sql, params in sample.statements:
+                plan = schema.explain(c, sql, params)
+                if plan:
+                    logger.warn('%s\n%s', sql.strip(), '\n'.join(plan))
+
     def _validate_artist(self, artist):
         if not artist.name:
             raise ValueError('Empty artist name')
@@ -240,6 +513,28 @@ class SQLiteLibrary(local.Library):
         return 'local:%s:md5:%s' % (type, digest)
 
 
+def _count(result):
+    if isinstance(result, SearchResult):
+        return len(result.tracks)
+    elif isinstance(result, dict):
+        return sum(map(len, result.values()))
+    elif isinstance(result, (list, set)):
+        return len(result)
+    else:
+        return 0
+
+
+def _lookup_type(uri):
+    if uri.startswith('local:album'):
+        return Ref.ALBUM
+    elif uri.startswith('local:artist'):
+        return Ref.ARTIST
+    elif uri.startswith('local:track'):
+        return Ref.TRACK
+    else:
+        return None
+
+
 def _dateref(date):
     return Ref.directory(
         uri=uritools.uricompose('local', None, 'directory', {'date': date}),
@@ -0,0 +1,33 @@
+from __future__ import unicode_literals
+
+import Queue
+import contextlib
+import threading
+
+
+class ConnectionPool(object):
+
+    def __init__(self, connect, maxsize):
+        self._connect = connect
+        self._idle = Queue.LifoQueue()
+        self._semaphore = threading.BoundedSemaphore(maxsize)
+
+    @contextlib.contextmanager
+    def connection(self):
+        with self._semaphore:
+            try:
+                connection = self._idle.get_nowait()
+            except Queue.Empty:
+                connection = self._connect()
+            try:
+                yield connection
+            finally:
+                self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Queue.Empty:
+                break
+            connection.close()
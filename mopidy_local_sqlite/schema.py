@@ -1,21 +1,32 @@
 from __future__ import unicode_literals
 
+import contextlib
+import functools
+import io
 import itertools
 import logging
 import operator
 import os
+import re
 import sqlite3
+import time
+import unicodedata
 
 from mopidy.models import Album, Artist, Ref, Track
 
+from . import cache
+
 _BROWSE_QUERIES = {
     None: """
-    SELECT CASE WHEN album.uri IS NULL THEN '%s' ELSE '%s' END AS type,
-           coalesce(album.uri, track.uri) AS uri,
-           coalesce(album.name, track.name) AS name
-      FROM track LEFT OUTER JOIN album ON track.album = album.uri
-     WHERE %%s
-     GROUP BY coalesce(album.uri, track.uri)
+    SELECT type, uri, name FROM (
+        SELECT CASE WHEN album.uri IS NULL THEN '%s' ELSE '%s' END AS type,
+               coalesce(album.uri, track.uri) AS uri,
+               coalesce(album.name, track.name) AS name,
+               coalesce(album.sortkey, track.sortkey) AS sortkey
+          FROM track LEFT OUTER JOIN album ON track.album = album.id
+         WHERE %%s
+         GROUP BY coalesce(album.uri, track.uri)
+    )
      ORDER BY %%s
     """ % (Ref.TRACK, Ref.ALBUM),
     Ref.ALBUM: """
@@ -38,97 +49,244 @@ _BROWSE_QUERIES = {
     """ % Ref.TRACK
 }
 
+_BROWSE_TABLES = {
+    Ref.ALBUM: 'album',
+    Ref.ARTIST: 'artist',
+    Ref.TRACK: 'track'
+}
+
 _BROWSE_FILTERS = {
     None: {
-        'album': 'track.album = ?',
-        'albumartist': 'album.artists = ?',
-        'artist': 'track.artists = ?',
-        'composer': 'track.composers = ?',
-        'date': "track.date LIKE ? || '%'",
+        'album': 'album.uri = ?',
+        'albumartist': """track.id IN (
+            SELECT track
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'albumartist'
+        )""",
+        'artist': """track.id IN (
+            SELECT track
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'artist'
+        )""",
+        'composer': """track.id IN (
+            SELECT track
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'composer'
+        )""",
+        'date': 'track.datekey >= ? AND track.datekey < ?',
         'genre': 'track.genre = ?',
-        'performer': 'track.performers = ?',
+        'performer': """track.id IN (
+            SELECT track
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'performer'
+        )""",
         'max-age': "track.last_modified >= (strftime('%s', 'now') - ?) * 1000",
     },
     Ref.ARTIST: {
         'role': {
-            'albumartist': """EXISTS (
-                SELECT * FROM album WHERE album.artists = artist.uri
+            'albumartist': """id IN (
+                SELECT artist FROM artist_role WHERE role = 'albumartist'
             )""",
-            'artist': """EXISTS (
-                SELECT * FROM track WHERE track.artists = artist.uri
+            'artist': """id IN (
+                SELECT artist FROM artist_role WHERE role = 'artist'
             )""",
-            'composer': """EXISTS (
-                SELECT * FROM track WHERE track.composers = artist.uri
+            'composer': """id IN (
+                SELECT artist FROM artist_role WHERE role = 'composer'
             )""",
-            'performer': """EXISTS (
-                SELECT * FROM track WHERE track.performers = artist.uri
+            'performer': """id IN (
+                SELECT artist FROM artist_role WHERE role = 'performer'
             )"""
         },
     },
     Ref.ALBUM: {
-        'albumartist': 'artists = ?',
-        'artist': """? IN (
-            SELECT artists FROM track WHERE album = album.uri
+        'albumartist': """id IN (
+            SELECT album
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'albumartist'
+        )""",
+        'artist': """id IN (
+            SELECT album
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'artist'
         )""",
-        'composer': """? IN (
-            SELECT composers FROM track WHERE album = album.uri
+        'composer': """id IN (
+            SELECT album
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'composer'
         )""",
-        'date': """EXISTS (
-            SELECT * FROM track WHERE album = album.uri AND date LIKE ? || '%'
+        'date': """id IN (
+            SELECT album FROM track WHERE datekey >= ? AND datekey < ?
         )""",
-        'genre': """? IN (
-            SELECT genre FROM track WHERE album = album.uri
+        'genre': """id IN (
+            SELECT album FROM track WHERE genre = ?
         )""",
-        'performer': """? IN (
-            SELECT performers FROM track WHERE album = album.uri
+        'performer': """id IN (
+            SELECT album
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'performer'
         )""",
-        'max-age': """EXISTS (
-            SELECT *
+        'max-age': """id IN (
+            SELECT album
               FROM track
-             WHERE album = album.uri
-               AND last_modified >= (strftime('%s', 'now') - ?) * 1000
+             WHERE last_modified >= (strftime('%s', 'now') - ?) * 1000
         )""",
     },
     Ref.TRACK: {
-        'album': 'album = ?',
-        'albumartist': """? IN (
-            SELECT artists FROM album WHERE uri = track.album
+        'album': 'album = (SELECT id FROM album WHERE uri = ?)',
+        'albumartist': """id IN (
+            SELECT track
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'albumartist'
         )""",
-        'artist': 'artists = ?',
-        'composer': 'composers = ?',
-        'date': "date LIKE ? || '%'",
+        'artist': """id IN (
+            SELECT track
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'artist'
+        )""",
+        'composer': """id IN (
+            SELECT track
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'composer'
+        )""",
+        'date': 'datekey >= ? AND datekey < ?',
         'genre': 'genre = ?',
-        'performer': 'performers = ?',
+        'performer': """id IN (
+            SELECT track
+              FROM artist_link
+             WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+               AND role = 'performer'
+        )""",
         'max-age': "last_modified >= (strftime('%s', 'now') - ?) * 1000",
     }
 }
 
 _LOOKUP_QUERIES = {
     Ref.ALBUM: """
-    SELECT * FROM tracks WHERE album_uri = ?
+    SELECT *
+      FROM tracks
+     WHERE album_uri = ?
+     ORDER BY disc_no, track_no, name, uri
     """,
     Ref.ARTIST: """
-    SELECT * FROM tracks WHERE ? IN (artist_uri, albumartist_uri)
+    SELECT *
+      FROM tracks
+     WHERE docid IN (
+        SELECT track
+          FROM artist_link
+         WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+           AND role IN (%s)
+    )
+     ORDER BY album_name, album_uri, disc_no, track_no, name, uri
     """,
     Ref.TRACK: """
     SELECT * FROM tracks WHERE uri = ?
     """
 }
 
+# tracks for up to _CHUNK_SIZE track, album or artist URIs
+_LOOKUP_MANY_QUERIES = {
+    Ref.ALBUM: """
+    SELECT album_uri AS lookup_uri, *
+      FROM tracks
+     WHERE album_uri IN (%s)
+     ORDER BY disc_no, track_no, name, uri
+    """,
+    Ref.ARTIST: """
+    SELECT artist.uri AS lookup_uri, tracks.*
+      FROM artist
+      JOIN tracks ON tracks.docid IN (
+        SELECT track
+          FROM artist_link
+         WHERE artist = artist.id AND role IN (%%s)
+    )
+     WHERE artist.uri IN (%s)
+     ORDER BY album_name, album_uri, disc_no, track_no, name, uri
+    """,
+    Ref.TRACK: """
+    SELECT uri AS lookup_uri, * FROM tracks WHERE uri IN (%s)
+    """
+}
+
 _SEARCH_SQL = """
 SELECT *
   FROM tracks
  WHERE docid IN (SELECT docid FROM %s WHERE %s)
 """
 
+_WORDS_RE = re.compile(r'\w+', re.UNICODE)
+
+# word characters as tokenized by FTS5 "unicode61", i.e. without "_"
+_TERMS_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+# release dates, possibly without month or day
+_DATE_RE = re.compile(r'(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?')
+
+# date filter values, matched as prefix of ISO dates
+_DATE_PREFIX_RE = re.compile(r'\d{0,4}$|\d{4}-\d{1,2}$|\d{4}-\d{2}-\d{1,2}$')
+
+# leading articles ignored when sorting names
+_ARTICLE_RE = re.compile(r'^(?:the|a|an) ', re.UNICODE)
+
+_SUGGEST_QUERY = """
+SELECT '%s' AS type, uri AS uri, name AS name
+  FROM %s
+ WHERE id IN (
+    SELECT DISTINCT id
+      FROM term
+     WHERE type = '%s' AND term >= ? AND term < ?%%s
+     LIMIT ?
+ )
+ ORDER BY name COLLATE NOCASE
+"""
+
+_FULLTEXT_SQL = """
+SELECT tracks.*
+  FROM (SELECT rowid AS docid, rank FROM fts WHERE fts MATCH ?) AS matches
+  JOIN tracks USING (docid)
+ WHERE 1
+"""
+
 _SEARCH_FILTERS = {
     'album': 'album_uri = ?',
-    'albumartist': 'albumartist_uri = ?',
-    'artist': 'artist_uri = ?',
-    'composer': 'composer_uri = ?',
-    'date': "date LIKE ? || '%'",
+    'albumartist': """docid IN (
+        SELECT track
+          FROM artist_link
+         WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+           AND role = 'albumartist'
+    )""",
+    'artist': """docid IN (
+        SELECT track
+          FROM artist_link
+         WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+           AND role = 'artist'
+    )""",
+    'composer': """docid IN (
+        SELECT track
+          FROM artist_link
+         WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+           AND role = 'composer'
+    )""",
+    'date': """docid IN (
+        SELECT id FROM track WHERE datekey >= ? AND datekey < ?
+    )""",
     'genre': 'genre = ?',
-    'performer': 'performer_uri = ?',
+    'performer': """docid IN (
+        SELECT track
+          FROM artist_link
+         WHERE artist = (SELECT id FROM artist WHERE uri = ?)
+           AND role = 'performer'
+    )""",
     'max-age': "last_modified >= (strftime('%s', 'now') - ?) * 1000",
 }
 
@@ -146,7 +304,247 @@ _SEARCH_FIELDS = {
     'comment'
 }
 
-schema_version = 6
+_ARTIST_COLUMNS = (
+    'uri',
+    'name',
+    'sortname',
+    'musicbrainz_id',
+    'sortkey',
+    'sortname_key'
+)
+
+_ALBUM_COLUMNS = (
+    'uri',
+    'name',
+    'artists',
+    'num_tracks',
+    'num_discs',
+    'date',
+    'musicbrainz_id',
+    'images',
+    'sortkey'
+)
+
+_LINK_COLUMNS = (
+    'artist',
+    'role',
+    'track',
+    'album',
+    'position'
+)
+
+_TRACK_COLUMNS = (
+    'uri',
+    'name',
+    'album',
+    'artists',
+    'composers',
+    'performers',
+    'genre',
+    'track_no',
+    'disc_no',
+    'date',
+    'length',
+    'bitrate',
+    'comment',
+    'musicbrainz_id',
+    'last_modified',
+    'sortkey',
+    'datekey',
+    'extra_artists',
+    'id'
+)
+
+# tables with integer keys, referenced by other tables' columns
+_KEY_TABLES = {'album', 'artist'}
+
+_FOREIGN_KEYS = {
+    ('album', 'artists'): 'artist',
+    ('artist_link', 'album'): 'album',
+    ('artist_link', 'artist'): 'artist',
+    ('track', 'album'): 'album',
+    ('track', 'artists'): 'artist',
+    ('track', 'composers'): 'artist',
+    ('track', 'performers'): 'artist'
+}
+
+# search fields matching any one of multiple artist names
+_ARTIST_FIELDS = {
+    'albumartist',
+    'artist',
+    'composer',
+    'performer'
+}
+
+_ARTIST_SEARCH = """docid IN (
+    SELECT track
+      FROM artist_link
+     WHERE role = '%s' AND artist IN (SELECT id FROM artist WHERE name = ?)
+)"""
+
+_ARTIST_DISTINCT = """
+SELECT DISTINCT name AS field
+  FROM artist
+ WHERE id IN (
+    SELECT artist
+      FROM artist_link
+     WHERE role = '%s' AND track IN (SELECT docid FROM search WHERE %s)
+ )
+"""
+
+# additional artists of tracks, see _extra_artists_sql()
+_EXTRA_ARTISTS_SQL = """
+SELECT artist_link.track                AS track,
+       artist_link.role                 AS role,
+       artist.uri                       AS artist_uri,
+       artist.name                      AS artist_name,
+       artist.sortname                  AS artist_sortname,
+       artist.musicbrainz_id            AS artist_musicbrainz_id
+  FROM artist_link
+  JOIN artist                           ON artist_link.artist = artist.id
+ WHERE artist_link.track IN (%s)
+   AND artist_link.position > 0
+ ORDER BY artist_link.track, artist_link.role, artist_link.position
+"""
+
+# highest track key in use, including keys of stale search table rows
+_TRACK_KEY_SQL = """
+SELECT max(
+    coalesce((SELECT max(id) FROM track), 0),
+    coalesce((SELECT max(docid) FROM search), 0)
+)
+"""
+
+# search table rows for tracks that have not been indexed yet
+_SEARCH_UPDATE_SQL = """
+SELECT * FROM search_rows WHERE docid NOT IN (SELECT docid FROM search)
+"""
+
+# library tables copied when migrating, in reverse order of insertion
+_MIGRATE_TABLES = ('artist_link', 'track', 'album', 'artist')
+
+# copy library tables renamed to old_<table>, which use URIs as keys in
+# all older schema versions
+_MIGRATE_SQL = {
+    'artist': """
+    INSERT INTO artist (uri, name, sortname, musicbrainz_id)
+    SELECT uri, name, %(sortname)s, musicbrainz_id FROM old_artist
+    """,
+    'album': """
+    INSERT INTO album (
+        uri,
+        name,
+        artists,
+        num_tracks,
+        num_discs,
+        date,
+        musicbrainz_id,
+        images
+    ) SELECT old_album.uri,
+             old_album.name,
+             artist.id,
+             old_album.num_tracks,
+             old_album.num_discs,
+             old_album.date,
+             old_album.musicbrainz_id,
+             old_album.images
+        FROM old_album
+        LEFT OUTER JOIN artist ON old_album.artists = artist.uri
+    """,
+    'track': """
+    INSERT INTO track (
+        uri,
+        name,
+        album,
+        artists,
+        composers,
+        performers,
+        genre,
+        track_no,
+        disc_no,
+        date,
+        length,
+        bitrate,
+        comment,
+        musicbrainz_id,
+        last_modified
+    ) SELECT old_track.uri,
+             old_track.name,
+             album.id,
+             artist.id,
+             composer.id,
+             performer.id,
+             old_track.genre,
+             old_track.track_no,
+             old_track.disc_no,
+             old_track.date,
+             old_track.length,
+             old_track.bitrate,
+             old_track.comment,
+             old_track.musicbrainz_id,
+             old_track.last_modified
+        FROM old_track
+        LEFT OUTER JOIN album ON old_track.album = album.uri
+        LEFT OUTER JOIN artist ON old_track.artists = artist.uri
+        LEFT OUTER JOIN artist AS composer
+          ON old_track.composers = composer.uri
+        LEFT OUTER JOIN artist AS performer
+          ON old_track.performers = performer.uri
+    """,
+    'artist_link': """
+    INSERT OR IGNORE INTO artist_link (artist, role, track, album, position)
+    SELECT artist.id, old_artist_link.role, track.id, album.id, %(position)s
+      FROM old_artist_link
+      JOIN artist ON old_artist_link.artist = artist.uri
+      JOIN track ON old_artist_link.track = track.uri
+      LEFT OUTER JOIN album ON old_artist_link.album = album.uri
+    """
+}
+
+# number of additional artists of tracks from older schema versions
+_MIGRATE_EXTRA_ARTISTS_SQL = """
+UPDATE track SET extra_artists = (
+    SELECT count(*) FROM artist_link WHERE track = track.id AND position > 0
+)
+"""
+
+# artist links of tracks from schema versions storing a single artist,
+# created from the already copied track table
+_MIGRATE_LINKS_SQL = """
+INSERT OR IGNORE INTO artist_link (artist, role, track, album, position)
+SELECT artists, 'artist', id, album, 0
+  FROM track WHERE artists IS NOT NULL
+ UNION ALL
+SELECT composers, 'composer', id, album, 0
+  FROM track WHERE composers IS NOT NULL
+ UNION ALL
+SELECT performers, 'performer', id, album, 0
+  FROM track WHERE performers IS NOT NULL
+ UNION ALL
+SELECT album.artists, 'albumartist', track.id, track.album, 0
+  FROM track JOIN album ON track.album = album.id
+ WHERE album.artists IS NOT NULL
+"""
+
+# transaction control statements skipped when migrating
+_TRANSACTION_STATEMENTS = (
+    'BEGIN EXCLUSIVE TRANSACTION;',
+    'END TRANSACTION;'
+)
+
+# number of URIs to pass to a single IN query
+_CHUNK_SIZE = 100
+
+for _type, _sql in _LOOKUP_MANY_QUERIES.items():
+    _LOOKUP_MANY_QUERIES[_type] = _sql % ', '.join(['?'] * _CHUNK_SIZE)
+
+# fraction of tracks added or removed to trigger a full ANALYZE
+_ANALYZE_THRESHOLD = 0.1
+
+# maximum number of distinct generated SQL statements to keep
+_STATEMENT_CACHE_SIZE = 256
+
+schema_version = 20
 
 logger = logging.getLogger(__name__)
 
@@ -158,69 +556,120 @@ class Connection(sqlite3.Connection):
         def __getattr__(self, name):
             return self[name]
 
+    # optional callback receiving executed statements and parameters
+    trace = None
+
     def __init__(self, *args, **kwargs):
+        # cache compiled versions of all memoized statements
+        kwargs.setdefault('cached_statements', _STATEMENT_CACHE_SIZE)
         sqlite3.Connection.__init__(self, *args, **kwargs)
         self.execute('PRAGMA foreign_keys = ON')
         self.row_factory = self.Row
 
+    def execute(self, sql, *args):
+        if self.trace is not None:
+            self.trace(sql, *args)
+        return sqlite3.Connection.execute(self, sql, *args)
+
 
 def load(c):
-    sql_dir = os.path.join(os.path.dirname(__file__), b'sql')
     user_version = c.execute('PRAGMA user_version').fetchone()[0]
-    while user_version != schema_version:
-        if user_version:
-            logger.info('Upgrading SQLite database schema v%s', user_version)
-            filename = 'upgrade-v%s.sql' % user_version
-        else:
-            logger.info('Creating SQLite database schema v%s', schema_version)
-            filename = 'schema.sql'
-        with open(os.path.join(sql_dir, filename)) as fh:
-            c.executescript(fh.read())
-        new_version = c.execute('PRAGMA user_version').fetchone()[0]
-        assert new_version != user_version
-        user_version = new_version
-    return user_version
+    if user_version == schema_version:
+        return user_version
+    elif user_version > schema_version:
+        raise sqlite3.DatabaseError(
+            'Unsupported SQLite database schema v%s' % user_version
+        )
+    sql_dir = os.path.join(os.path.dirname(__file__), b'sql')
+    with io.open(os.path.join(sql_dir, 'schema.sql'), encoding='utf-8') as fh:
+        script = fh.read()
+    if user_version:
+        _migrate(c, user_version, script)
+    else:
+        logger.info('Creating SQLite database schema v%s', schema_version)
+        c.executescript(script)
+    return c.execute('PRAGMA user_version').fetchone()[0]
+
+
+def set_pragmas(c, **pragmas):
+    for name, value in pragmas.items():
+        c.execute('PRAGMA %s = %s' % (name, value))
+
+
+def checkpoint(c):
+    # no-op unless the database is in WAL mode
+    return c.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
 
 
-def tracks(c):
-    return itertools.imap(_track, c.execute('SELECT * FROM tracks'))
+def tracks(c, cache=None):
+    return _tracks(c, c.execute('SELECT * FROM tracks'), cache)
+
+
+def last_modified(c):
+    return c.execute('SELECT uri, last_modified FROM track')
 
 
 def list_distinct(c, field, query=[]):
-    if field not in _SEARCH_FIELDS:
-        raise LookupError('Invalid search field: %s' % field)
-    sql = """
-    SELECT DISTINCT %s AS field
-      FROM search
-     WHERE field IS NOT NULL
-    """ % field
-    terms = []
-    params = []
-    for key, value in query:
-        if key == 'any':
-            terms.append('? IN (%s)' % ','.join(_SEARCH_FIELDS))
-        elif key in _SEARCH_FIELDS:
-            terms.append('%s = ?' % key)
-        else:
-            raise LookupError('Invalid search field: %s' % key)
-        params.append(value)
-    if terms:
-        sql += ' AND ' + ' AND '.join(terms)
-    logger.debug('SQLite list query %r: %s', params, sql)
+    query = sorted(query)
+    sql = _list_distinct_sql(field, tuple(key for key, _ in query))
+    params = _query_params(query, exact=True)
     return itertools.imap(operator.itemgetter(0), c.execute(sql, params))
 
 
-def dates(c, format='%Y-%m-%d'):
+def genres(c):
     return itertools.imap(operator.itemgetter(0), c.execute("""
-    SELECT DISTINCT strftime(?, date) AS date
-      FROM track
-     WHERE date IS NOT NULL
-     ORDER BY date
-    """, [format]))
+    SELECT genre FROM genre_count ORDER BY genre COLLATE NOCASE
+    """))
+
+
+def dates(c, format='%Y-%m-%d'):
+    # dates are only distinguished down to the smallest unit in format,
+    # and named by ISO date prefix, so they can be used as filter values
+    if '%d' in format:
+        scale = 1
+    elif '%m' in format:
+        scale = 100
+    else:
+        scale = 10000
+    return (_datestr(row[0] * scale) for row in c.execute("""
+    SELECT DISTINCT datekey / ? FROM date_count ORDER BY 1
+    """, [scale]))
+
+
+def lookup(c, type, uri, cache=None, role=('albumartist', 'artist')):
+    if isinstance(role, basestring):
+        role = (role,)
+    sql = _lookup_sql(type, tuple(sorted(role)))
+    return _tracks(c, c.execute(sql, [uri]), cache)
+
 
+def lookup_many(c, type, uris, cache=None, role=('albumartist', 'artist')):
+    if isinstance(role, basestring):
+        role = (role,)
+    sql = _lookup_sql(type, tuple(sorted(role)), True)
+    uris = sorted(set(uris))
+    result = {uri: [] for uri in uris}
+    for i in range(0, len(uris), _CHUNK_SIZE):
+        chunk = uris[i:i + _CHUNK_SIZE]
+        params = chunk + [None] * (_CHUNK_SIZE - len(chunk))
+        rows = c.execute(sql, params).fetchall()
+        for row, track in zip(rows, _tracks(c, iter(rows), cache)):
+            result[row.lookup_uri].append(track)
+    return result
 
-def lookup(c, type, uri):
-    return itertools.imap(_track, c.execute(_LOOKUP_QUERIES[type], [uri]))
+
+def suggest(c, prefix, limit):
+    terms = _terms(prefix)
+    if not terms:
+        return []
+    # match last term as a prefix, any preceding terms exactly
+    last = terms.pop()
+    params = [last, last[:-1] + unichr(ord(last[-1]) + 1)] + terms + [limit]
+    refs = []
+    for type in (Ref.ARTIST, Ref.ALBUM, Ref.TRACK):
+        sql = _suggest_sql(type, len(terms))
+        refs.extend(Ref(**row) for row in c.execute(sql, params))
+    return refs
 
 
 def exists(c, uri):
@@ -228,185 +677,798 @@ def exists(c, uri):
     return rows.fetchone()[0]
 
 
-def browse(c, type=None, order=('type', 'name COLLATE NOCASE'), **kwargs):
-    filters, params = _filters(_BROWSE_FILTERS[type], **kwargs)
-    sql = _BROWSE_QUERIES[type] % (
-        ' AND '.join(filters) or '1',
-        ', '.join(order)
+def browse(c, type=None, order=('type', 'sortkey'),
+           limit=None, after=None, role=None, **kwargs):
+    if role is not None and not isinstance(role, basestring):
+        role = tuple(role)
+    keys = _filter_keys(_BROWSE_FILTERS[type], kwargs)
+    sql = _browse_sql(
+        type, tuple(order), role, keys, limit is not None, after is not None
     )
-    logger.debug('SQLite browse query %r: %s', params, sql)
+    params = _filter_params(keys, kwargs)
+    if after is not None:
+        params.append(after)
+    if limit is not None:
+        params.append(limit)
     return [Ref(**row) for row in c.execute(sql, params)]
 
 
-def search_tracks(c, query, limit, offset, exact, filters=[]):
-    if not query:
-        sql, params = ('SELECT * FROM tracks WHERE 1', [])
-    elif exact:
-        sql, params = _indexed_query(query)
-    else:
-        sql, params = _fulltext_query(query)
+def search_tracks(c, query, limit, offset, exact, filters=[], cache=None):
+    query = sorted(query)
     clauses = []
     for kwargs in filters:
-        f, p = _filters(_SEARCH_FILTERS, **kwargs)
-        if f:
-            clauses.append('(%s)' % ' AND '.join(f))
-            params.extend(p)
+        keys = _filter_keys(_SEARCH_FILTERS, kwargs)
+        if keys:
+            clauses.append((keys, kwargs))
         else:
             logger.debug('Skipped SQLite search filter %r', kwargs)
-    if clauses:
-        sql += ' AND (%s)' % ' OR '.join(clauses)
-    sql += ' LIMIT ? OFFSET ?'
-    params += [limit, offset]
-    logger.debug('SQLite search query %r: %s', params, sql)
-    rows = c.execute(sql, params)
-    return map(_track, rows)
+    sql = _search_sql(
+        tuple(field for field, _ in query),
+        exact,
+        tuple(keys for keys, _ in clauses)
+    )
+    params = _query_params(query, exact)
+    for keys, kwargs in clauses:
+        params.extend(_filter_params(keys, kwargs))
+    params.extend([limit, offset])
+    return list(_tracks(c, c.execute(sql, params), cache))
 
 
 def insert_artists(c, artists):
-    if not artists:
-        return None
-    if len(artists) != 1:
-        logger.warn('Ignoring multiple artists: %r', artists)
-    artist = next(iter(artists))
-    _insert(c, 'artist', {
-        'uri': artist.uri,
-        'name': artist.name,
-        'sortname': artist.sortname,
-        'musicbrainz_id': artist.musicbrainz_id
-    })
-    return artist.uri
+    rows = {}
+    uri = _artist_uri(artists, rows)
+    _insert_many(c, 'artist', _ARTIST_COLUMNS, rows.values())
+    return uri
 
 
 def insert_album(c, album):
-    if not album or not album.name:
-        return None
-    _insert(c, 'album', {
-        'uri': album.uri,
-        'name': album.name,
-        'artists': insert_artists(c, album.artists),
-        'num_tracks': album.num_tracks,
-        'num_discs': album.num_discs,
-        'date': album.date,
-        'musicbrainz_id': album.musicbrainz_id,
-        'images': ' '.join(album.images) if album.images else None
-    })
-    return album.uri
+    artists, rows = {}, {}
+    uri = _album_uri(album, artists, rows)
+    _insert_many(c, 'artist', _ARTIST_COLUMNS, artists.values())
+    _insert_many(c, 'album', _ALBUM_COLUMNS, rows.values())
+    return uri
 
 
 def insert_track(c, track):
-    _insert(c, 'track', {
-        'uri': track.uri,
-        'name': track.name,
-        'album': insert_album(c, track.album),
-        'artists': insert_artists(c, track.artists),
-        'composers': insert_artists(c, track.composers),
-        'performers': insert_artists(c, track.performers),
-        'genre': track.genre,
-        'track_no': track.track_no,
-        'disc_no': track.disc_no,
-        'date': track.date,
-        'length': track.length,
-        'bitrate': track.bitrate,
-        'comment': track.comment,
-        'musicbrainz_id': track.musicbrainz_id,
-        'last_modified': track.last_modified
-    })
+    insert_tracks(c, [track])
     return track.uri
 
 
+def insert_tracks(c, tracks):
+    tracks = list(tracks)
+    ids = _track_ids(c, tracks)
+    artists, albums, links, rows = {}, {}, [], []
+    for track in tracks:
+        album_uri = _album_uri(track.album, artists, albums)
+        count = len(links)
+        for role, values in (
+            ('artist', track.artists),
+            ('composer', track.composers),
+            ('performer', track.performers),
+            ('albumartist', track.album.artists if album_uri else None)
+        ):
+            links.extend(
+                (artist.uri, role, ids[track.uri], album_uri, position)
+                for position, artist in enumerate(values or [])
+            )
+        rows.append((
+            track.uri,
+            track.name,
+            album_uri,
+            _artist_uri(track.artists, artists),
+            _artist_uri(track.composers, artists),
+            _artist_uri(track.performers, artists),
+            track.genre,
+            track.track_no,
+            track.disc_no,
+            track.date,
+            track.length,
+            track.bitrate,
+            track.comment,
+            track.musicbrainz_id,
+            track.last_modified,
+            sortkey(track.name),
+            _datekey(track.date or track.album and track.album.date),
+            sum(link[-1] > 0 for link in links[count:]),
+            ids[track.uri]
+        ))
+    _insert_many(c, 'artist', _ARTIST_COLUMNS, artists.values())
+    _insert_many(c, 'album', _ALBUM_COLUMNS, albums.values())
+    # search table triggers need all artists when inserting tracks
+    c.executemany("""
+    DELETE FROM artist_link WHERE track = (SELECT id FROM track WHERE uri = ?)
+    """, (row[:1] for row in rows))
+    c.executemany(_insert_sql('artist_link', _LINK_COLUMNS, 'IGNORE'), links)
+    _insert_many(c, 'track', _TRACK_COLUMNS, rows)
+    _insert_terms(c, Ref.ARTIST, artists.values())
+    _insert_terms(c, Ref.ALBUM, albums.values())
+    _insert_terms(c, Ref.TRACK, rows)
+    return len(rows)
+
+
 def delete_track(c, uri):
     c.execute('DELETE FROM track WHERE uri = ?', (uri,))
 
 
+def explain(c, sql, params=()):
+    return [row[-1] for row in c.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def data_version(c):
+    return c.execute('PRAGMA data_version').fetchone()[0]
+
+
 def count_tracks(c):
     return c.execute('SELECT count(*) FROM track').fetchone()[0]
 
 
 def cleanup(c):
+    # only check albums and artists recorded by triggers; deleting
+    # albums records their artists, so albums have to go first
     c.execute("""
-    DELETE FROM album WHERE NOT EXISTS (
-        SELECT uri FROM track WHERE track.album = album.uri
-    )
+    DELETE FROM album
+     WHERE id IN (SELECT id FROM dirty WHERE type = 'album')
+       AND NOT EXISTS (SELECT * FROM track WHERE track.album = album.id)
     """)
     c.execute("""
-    DELETE FROM artist WHERE NOT EXISTS (
-        SELECT uri FROM track WHERE track.artists = artist.uri
-         UNION
-        SELECT uri FROM track WHERE track.composers = artist.uri
-         UNION
-        SELECT uri FROM track WHERE track.performers = artist.uri
-         UNION
-        SELECT uri FROM album WHERE album.artists = artist.uri
-    )
+    DELETE FROM artist
+     WHERE id IN (SELECT id FROM dirty WHERE type = 'artist')
+       AND NOT EXISTS (SELECT * FROM artist_link WHERE artist = artist.id)
+       AND NOT EXISTS (SELECT * FROM album WHERE album.artists = artist.id)
+    """)
+    c.execute('DELETE FROM dirty')
+
+
+def optimize(c, changes):
+    # gather statistics from scratch after larger changes only
+    if changes >= count_tracks(c) * _ANALYZE_THRESHOLD:
+        c.execute('ANALYZE')
+    else:
+        c.execute('PRAGMA optimize')
+
+
+@contextlib.contextmanager
+def savepoint(c, name='tracks'):
+    # sqlite3 would commit before SAVEPOINT and ROLLBACK TO statements
+    # unless transactions are managed explicitly, i.e. the isolation
+    # level is None; savepoints then nest inside an open transaction
+    c.execute('SAVEPOINT %s' % name)
+    try:
+        yield c
+    except BaseException:
+        c.execute('ROLLBACK TO %s' % name)
+        raise
+    finally:
+        c.execute('RELEASE %s' % name)
+
+
+def in_bulk(c):
+    return c.execute('SELECT EXISTS (SELECT * FROM bulk)').fetchone()[0]
+
+
+def begin_bulk(c):
+    c.execute("INSERT INTO bulk VALUES (strftime('%s', 'now') * 1000)")
+
+
+def end_bulk(c):
+    c.execute('DELETE FROM bulk')
+    update_search(c)
+    update_summaries(c)
+
+
+def update_search(c):
+    c.execute("""
+    INSERT INTO fts (
+        fts,
+        rowid,
+        uri,
+        track_name,
+        album,
+        artist,
+        composer,
+        performer,
+        albumartist,
+        genre,
+        track_no,
+        date,
+        comment
+    ) SELECT 'delete', *
+        FROM search
+       WHERE docid NOT IN (SELECT id FROM track)
+    """)
+    c.execute("""
+    DELETE FROM search WHERE docid NOT IN (SELECT id FROM track)
+    """)
+    # index new tracks first, since they cannot be told apart afterwards
+    c.execute("""
+    INSERT INTO fts (
+        rowid,
+        uri,
+        track_name,
+        album,
+        artist,
+        composer,
+        performer,
+        albumartist,
+        genre,
+        track_no,
+        date,
+        comment
+    ) %s
+    """ % _SEARCH_UPDATE_SQL)
+    c.execute("""
+    INSERT INTO search (
+        docid,
+        uri,
+        track_name,
+        album,
+        artist,
+        composer,
+        performer,
+        albumartist,
+        genre,
+        track_no,
+        date,
+        comment
+    ) %s
+    """ % _SEARCH_UPDATE_SQL)
+
+
+def update_summaries(c):
+    c.execute('DELETE FROM genre_count')
+    c.execute('DELETE FROM date_count')
+    c.execute('DELETE FROM artist_role')
+    c.execute("""
+    INSERT INTO genre_count (genre, count)
+    SELECT genre, count(*) FROM track WHERE genre IS NOT NULL GROUP BY genre
     """)
-    c.execute('ANALYZE')
+    c.execute("""
+    INSERT INTO date_count (datekey, count)
+    SELECT datekey, count(*)
+      FROM track
+     WHERE datekey IS NOT NULL
+     GROUP BY datekey
+    """)
+    c.execute("""
+    INSERT INTO artist_role (role, artist, count)
+    SELECT role, artist, count(*) FROM artist_link GROUP BY role, artist
+    """)
+
+
+def update_sortkeys(c):
+    for table in ('artist', 'album', 'track'):
+        rows = c.execute(
+            'SELECT uri, name FROM %s WHERE sortkey IS NULL' % table
+        ).fetchall()
+        c.executemany('UPDATE %s SET sortkey = ? WHERE uri = ?' % table, (
+            (sortkey(name), uri) for uri, name in rows
+        ))
+    rows = c.execute("""
+    SELECT uri, coalesce(sortname, name) FROM artist WHERE sortname_key IS NULL
+    """).fetchall()
+    c.executemany('UPDATE artist SET sortname_key = ? WHERE uri = ?', (
+        (sortkey(name), uri) for uri, name in rows
+    ))
+
+
+def update_datekeys(c):
+    rows = c.execute("""
+    SELECT track.uri, coalesce(track.date, album.date)
+      FROM track LEFT OUTER JOIN album ON track.album = album.id
+     WHERE track.datekey IS NULL
+    """).fetchall()
+    c.executemany('UPDATE track SET datekey = ? WHERE uri = ?', (
+        (_datekey(date), uri) for uri, date in rows
+    ))
+
+
+def update_terms(c):
+    for type, table in sorted(_BROWSE_TABLES.items()):
+        _insert_terms(c, type, c.execute("""
+        SELECT uri, name
+          FROM %s
+         WHERE id NOT IN (SELECT id FROM term WHERE type = '%s')
+        """ % (table, type)).fetchall())
 
 
 def clear(c):
     c.executescript("""
+    DELETE FROM bulk;
+    DELETE FROM term;
+    INSERT INTO fts (fts) VALUES ('delete-all');
+    DELETE FROM search;
     DELETE FROM track;
     DELETE FROM album;
     DELETE FROM artist;
+    DELETE FROM dirty;
+    DELETE FROM artist_link;
+    DELETE FROM genre_count;
+    DELETE FROM date_count;
+    DELETE FROM artist_role;
     VACUUM;
     """)
 
 
-def _insert(c, table, params):
-    sql = 'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+def _migrate(c, user_version, script):
+    logger.info(
+        'Migrating SQLite database schema v%s to v%s; this may take a while',
+        user_version, schema_version
+    )
+    start = time.time()
+    # manage the transaction explicitly, so that DDL statements do not
+    # commit and an interrupted migration is rolled back as a whole
+    isolation_level = c.isolation_level
+    c.isolation_level = None
+    try:
+        c.execute('BEGIN EXCLUSIVE TRANSACTION')
+        try:
+            tables = _migrate_tables(c, script)
+            logger.info('Copying SQLite library tables')
+            begin_bulk(c)
+            _migrate_data(c, tables)
+            update_sortkeys(c)
+            update_datekeys(c)
+            logger.info('Building SQLite search index for %d tracks',
+                        count_tracks(c))
+            end_bulk(c)
+            logger.info('Building SQLite suggestion index')
+            update_terms(c)
+            c.execute('COMMIT')
+        except BaseException:
+            c.execute('ROLLBACK')
+            raise
+    finally:
+        c.isolation_level = isolation_level
+    logger.info('Migrated SQLite database schema v%s to v%s in %.1fs',
+                user_version, schema_version, time.time() - start)
+
+
+def _migrate_tables(c, script):
+    # rename library tables for copying, drop everything else
+    c.execute('DROP TABLE IF EXISTS fts')
+    tables = set()
+    for type, name in c.execute("""
+    SELECT type, name
+      FROM sqlite_master
+     WHERE type IN ('index', 'table', 'trigger', 'view')
+       AND name NOT LIKE 'sqlite_%'
+    """).fetchall():
+        if type == 'table' and name in _MIGRATE_TABLES:
+            tables.add(name)
+        else:
+            c.execute('DROP %s IF EXISTS %s' % (type.upper(), name))
+    for name in tables:
+        c.execute('ALTER TABLE %s RENAME TO old_%s' % (name, name))
+    for sql in _statements(script):
+        if sql.upper() not in _TRANSACTION_STATEMENTS:
+            c.execute(sql)
+    return tables
+
+
+def _migrate_data(c, tables):
+    columns = {
+        name: {row[1] for row in c.execute('PRAGMA table_info(old_%s)' % name)}
+        for name in tables
+    }
+    if 'id' in columns['album']:
+        # integer keys, copy all columns still present; artist links
+        # refer to tracks by key only if tracks have integer keys, too
+        for name in reversed(_MIGRATE_TABLES):
+            if name == 'artist_link' and 'id' not in columns['track']:
+                continue
+            names = ', '.join(
+                row[1] for row in c.execute('PRAGMA table_info(%s)' % name)
+                if row[1] in columns[name]
+            )
+            c.execute("""
+            INSERT OR IGNORE INTO %s (%s) SELECT %s FROM old_%s
+            """ % (name, names, names, name))
+    else:
+        _migrate_uri_data(c, columns)
+    if 'id' not in columns['track']:
+        _migrate_links(c, tables, columns)
+    if 'extra_artists' not in columns['track']:
+        c.execute(_MIGRATE_EXTRA_ARTISTS_SQL)
+    for name in _MIGRATE_TABLES:
+        if name in tables:
+            c.execute('DROP TABLE old_%s' % name)
+
+
+def _migrate_uri_data(c, columns):
+    c.execute(_MIGRATE_SQL['artist'] % {
+        'sortname': 'sortname' if 'sortname' in columns['artist'] else 'NULL'
+    })
+    c.execute(_MIGRATE_SQL['album'])
+    c.execute(_MIGRATE_SQL['track'])
+
+
+def _migrate_links(c, tables, columns):
+    # links have to go last, since inserting albums updates them
+    if 'artist_link' in tables:
+        c.execute(_MIGRATE_SQL['artist_link'] % {
+            'position': 'old_artist_link.position'
+            if 'position' in columns['artist_link'] else '0'
+        })
+    else:
+        c.execute(_MIGRATE_LINKS_SQL)
+
+
+def _statements(script):
+    sql = ''
+    for line in script.splitlines(True):
+        if not sql and (not line.strip() or line.startswith('--')):
+            continue  # skip comments between statements
+        sql += line
+        if sqlite3.complete_statement(sql.encode('utf-8')):
+            yield sql.strip()
+            sql = ''
+
+
+def _insert_many(c, table, columns, rows):
+    return c.executemany(_insert_sql(table, columns), rows)
+
+
+def _insert_terms(c, type, rows):
+    # rows start with uri and name
+    c.executemany(_insert_terms_sql(type), (
+        (type, term, row[0]) for row in rows for term in set(_terms(row[1]))
+    ))
+
+
+def _track_ids(c, tracks):
+    # assign keys up front, since artist links are written before their
+    # tracks; replaced tracks get new keys, and keys of deleted tracks
+    # still in the search table are not reused, so that end_bulk() can
+    # tell stale search table rows from current ones
+    ids = {}
+    key = c.execute(_TRACK_KEY_SQL).fetchone()[0]
+    for track in tracks:
+        if track.uri not in ids:
+            ids[track.uri] = key = key + 1
+    return ids
+
+
+def _fold(name):
+    if isinstance(name, bytes):
+        name = name.decode('utf-8', 'replace')
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch))
+    return name.lower()
+
+
+def _terms(name):
+    return _TERMS_RE.findall(_fold(name))
+
+
+def sortkey(name):
+    if name is None:
+        return None
+    key = ' '.join(_fold(name).split())
+    return _ARTICLE_RE.sub('', key, 1) or key
+
+
+def _datekey(date):
+    match = _DATE_RE.match(date or '')
+    if not match:
+        return None
+    year, month, day = match.groups('0')
+    return int(year) * 10000 + int(month) * 100 + int(day)
+
+
+def _datestr(datekey):
+    year, month, day = datekey // 10000, datekey // 100 % 100, datekey % 100
+    if not month:
+        return '%04d' % year
+    elif not day:
+        return '%04d-%02d' % (year, month)
+    else:
+        return '%04d-%02d-%02d' % (year, month, day)
+
+
+def _date_range(date):
+    # key range of dates starting with date; nothing if not a date prefix
+    if not _DATE_PREFIX_RE.match(date):
+        return (None, None)
+    digits = date.replace('-', '')
+    scale = 10 ** (8 - len(digits))
+    start = int(digits or 0) * scale
+    return (start, start + scale)
+
+
+def _artist_uri(artists, rows):
+    if not artists:
+        return None
+    for artist in artists:
+        rows[artist.uri] = (
+            artist.uri,
+            artist.name,
+            artist.sortname,
+            artist.musicbrainz_id,
+            sortkey(artist.name),
+            sortkey(artist.sortname or artist.name)
+        )
+    # first artist, additional artists are stored in artist_link
+    return next(iter(artists)).uri
+
+
+def _album_uri(album, artists, rows):
+    if not album or not album.name:
+        return None
+    rows[album.uri] = (
+        album.uri,
+        album.name,
+        _artist_uri(album.artists, artists),
+        album.num_tracks,
+        album.num_discs,
+        album.date,
+        album.musicbrainz_id,
+        ' '.join(album.images) if album.images else None,
+        sortkey(album.name)
+    )
+    return album.uri
+
+
+def _memoized(func):
+    memo = cache.LRUCache(_STATEMENT_CACHE_SIZE)
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        sql = memo.get(args)
+        if sql is None:
+            sql = func(*args)
+            logger.debug('SQLite statement %s%r: %s', func.__name__, args, sql)
+            memo.put(args, sql)
+        return sql
+    return wrapper
+
+
+@_memoized
+def _extra_artists_sql(count):
+    return _EXTRA_ARTISTS_SQL % ', '.join(['?'] * count)
+
+
+@_memoized
+def _insert_terms_sql(type):
+    return """
+    INSERT OR IGNORE INTO term (type, term, id)
+    SELECT ?1, ?2, id FROM %s WHERE uri = ?3
+    """ % _BROWSE_TABLES[type]
+
+
+@_memoized
+def _insert_sql(table, columns, conflict='REPLACE'):
+    # rows contain URIs, which are mapped to integer keys
+    values = []
+    for i, column in enumerate(columns, 1):
+        if (table, column) in _FOREIGN_KEYS:
+            values.append('(SELECT id FROM %s WHERE uri = ?%d)' % (
+                _FOREIGN_KEYS[(table, column)], i
+            ))
+        else:
+            values.append('?%d' % i)
+    if table in _KEY_TABLES:
+        # keep keys of replaced rows, which may still be referenced
+        columns = ('id',) + columns
+        values.insert(0, '(SELECT id FROM %s WHERE uri = ?1)' % table)
+    return 'INSERT OR %s INTO %s (%s) VALUES (%s)' % (
+        conflict,
         table,
-        ', '.join(params.keys()),
-        ', '.join(['?'] * len(params))
+        ', '.join(columns),
+        ', '.join(values)
+    )
+
+
+@_memoized
+def _list_distinct_sql(field, keys):
+    if field not in _SEARCH_FIELDS:
+        raise LookupError('Invalid search field: %s' % field)
+    terms = map(_search_term, keys)
+    if field in _ARTIST_FIELDS:
+        return _ARTIST_DISTINCT % (field, ' AND '.join(terms) or '1')
+    sql = """
+    SELECT DISTINCT %s AS field
+      FROM search
+     WHERE field IS NOT NULL
+    """ % field
+    if terms:
+        sql += ' AND ' + ' AND '.join(terms)
+    return sql
+
+
+@_memoized
+def _browse_sql(type, order, role, keys, limit, after):
+    filters = _filters(_BROWSE_FILTERS[type], role, keys)
+    if type is not None:
+        # "type" is constant for single-type queries and not a column, so
+        # ordering by it would keep SQLite from using sort key indexes
+        order = tuple(expr for expr in order if expr != 'type')
+    if limit or after:
+        # keyset pagination requires a total order
+        order += ('uri',)
+    if after:
+        filters.append('(%s) > (SELECT %s FROM %s WHERE uri = ?)' % (
+            ', '.join(order), ', '.join(order), _BROWSE_TABLES[type]
+        ))
+    sql = _BROWSE_QUERIES[type] % (
+        ' AND '.join(filters) or '1',
+        ', '.join(order)
     )
-    logger.debug('SQLite insert statement: %s %r', sql, params.values())
-    return c.execute(sql, params.values())
+    if limit:
+        sql += ' LIMIT ?'
+    return sql
+
+
+@_memoized
+def _lookup_sql(type, roles, many=False):
+    queries = _LOOKUP_MANY_QUERIES if many else _LOOKUP_QUERIES
+    if type != Ref.ARTIST:
+        return queries[type]
+    for role in roles:
+        if role not in _ARTIST_FIELDS:
+            raise LookupError('Invalid artist role: %s' % role)
+    return queries[type] % ', '.join("'%s'" % role for role in roles)
+
+
+@_memoized
+def _suggest_sql(type, count):
+    sql = _SUGGEST_QUERY % (type, _BROWSE_TABLES[type], type)
+    term = " AND id IN (SELECT id FROM term WHERE type = '%s' AND term = ?)"
+    return sql % ''.join([term % type] * count)
+
+
+@_memoized
+def _search_sql(fields, exact, filters):
+    if not fields:
+        sql = 'SELECT * FROM tracks WHERE 1'
+    elif exact:
+        sql = _indexed_query(fields)
+    else:
+        sql = _fulltext_query(fields)
+    clauses = [
+        '(%s)' % ' AND '.join(_filters(_SEARCH_FILTERS, None, keys))
+        for keys in filters
+    ]
+    if clauses:
+        sql += ' AND (%s)' % ' OR '.join(clauses)
+    if fields and not exact:
+        sql += ' ORDER BY matches.rank'
+    return sql + ' LIMIT ? OFFSET ?'
+
+
+def _filter_keys(mapping, kwargs):
+    keys = []
+    for key, value in kwargs.items():
+        if key in mapping and key != 'role':
+            keys.append(key)
+        else:
+            logger.debug('Skipped SQLite filter expression: %s=%r', key, value)
+    return tuple(sorted(keys))
+
+
+def _filter_params(keys, kwargs):
+    params = []
+    for key in keys:
+        if key == 'date':
+            params.extend(_date_range(kwargs[key]))
+        else:
+            params.append(kwargs[key])
+    return params
 
 
-def _filters(mapping, role=None, **kwargs):
-    filters, params = [], []
+def _filters(mapping, role, keys):
+    filters = []
     if role and 'role' in mapping:
         rolemap = mapping['role']
         if isinstance(role, basestring):
             filters.append(rolemap[role])
         else:
-            filters.append(' OR '.join(rolemap[r] for r in role))
-    for key, value in kwargs.items():
-        if key in mapping:
-            filters.append(mapping[key])
-            params.append(value)
-        else:
-            logger.debug('Skipped SQLite filter expression: %s=%r', key, value)
-    return (filters, params)
+            filters.append('(%s)' % ' OR '.join(rolemap[r] for r in role))
+    filters.extend(mapping[key] for key in keys)
+    return filters
 
 
-def _indexed_query(query):
-    terms = []
+def _query_params(query, exact):
+    if query and not exact:
+        return [_match_expression(query)]
     params = []
     for field, value in query:
-        if field == 'any':
-            terms.append('? IN (%s)' % ','.join(_SEARCH_FIELDS))
-        elif field in _SEARCH_FIELDS:
-            terms.append('%s = ?' % field)
+        if exact and field == 'any':
+            params.extend([value] * len(_SEARCH_FIELDS))
         else:
+            params.append(value)
+    return params
+
+
+def _indexed_query(fields):
+    terms = map(_search_term, fields)
+    return _SEARCH_SQL % ('search', ' AND '.join(terms))
+
+
+def _search_term(field):
+    if field == 'any':
+        # exact "any" search as a union of indexed lookups
+        return 'docid IN (%s)' % ' UNION ALL '.join(
+            'SELECT docid FROM search WHERE %s' % _search_term(field)
+            for field in sorted(_SEARCH_FIELDS)
+        )
+    elif field in _ARTIST_FIELDS:
+        return _ARTIST_SEARCH % field
+    elif field in _SEARCH_FIELDS:
+        return '%s = ?' % field
+    else:
+        raise LookupError('Invalid search field: %s' % field)
+
+
+def _fulltext_query(fields):
+    for field in fields:
+        if field != 'any' and field not in _SEARCH_FIELDS:
             raise LookupError('Invalid search field: %s' % field)
-        params.append(value)
-    return (_SEARCH_SQL % ('search', ' AND '.join(terms)), params)
+    return _FULLTEXT_SQL
 
 
-def _fulltext_query(query):
+def _match_expression(query):
     terms = []
-    params = []
     for field, value in query:
-        if field == 'any':
-            terms.append(_SEARCH_SQL % ('fts', 'fts MATCH ?'))
-        elif field in _SEARCH_FIELDS:
-            terms.append(_SEARCH_SQL % ('fts', '%s MATCH ?' % field))
+        # match each word as a token prefix, quoted to escape FTS5 syntax
+        phrases = ' '.join(
+            '"%s"*' % token for token in _WORDS_RE.findall(value)
+        )
+        if not phrases:
+            continue
+        elif field == 'any':
+            terms.append('(%s)' % phrases)
         else:
-            raise LookupError('Invalid search field: %s' % field)
-        params.append(value)
-    return (' INTERSECT '.join(terms), params)
+            terms.append('%s : (%s)' % (field, phrases))
+    return ' AND '.join(terms) or '""'
 
 
-def _track(row):
+def _tracks(c, rows, cache=None):
+    while True:
+        chunk = list(itertools.islice(rows, _CHUNK_SIZE))
+        if not chunk:
+            break
+        # query additional artists for a whole chunk of tracks at once
+        ids = [row.docid for row in chunk if row.extra_artists]
+        extras = {}
+        if ids:
+            # pad to a power of two to limit the number of statements
+            size = 1 << (len(ids) - 1).bit_length()
+            params = ids + [None] * (size - len(ids))
+            for row in c.execute(_extra_artists_sql(size), params):
+                artists = extras.setdefault(row.track, {})
+                artists.setdefault(row.role, []).append(
+                    _artist(row, 'artist', cache)
+                )
+        for row in chunk:
+            yield _track(row, cache, extras.get(row.docid, {}))
+
+
+def _track(row, cache=None, extras={}):
+    key = (Ref.TRACK, row.uri, row.last_modified)
+    return _cached(cache, key, _build_track, row, cache, extras)
+
+
+def _album(row, cache=None, extras=[]):
+    key = (Ref.ALBUM, row.album_uri)
+    return _cached(cache, key, _build_album, row, cache, extras)
+
+
+def _artist(row, role, cache=None):
+    key = (Ref.ARTIST, getattr(row, role + '_uri'))
+    return _cached(cache, key, _build_artist, row, role)
+
+
+def _cached(cache, key, factory, *args):
+    if cache is None:
+        return factory(*args)
+    value = cache.get(key)
+    if value is None:
+        value = factory(*args)
+        cache.put(key, value)
+    return value
+
+
+def _build_track(row, cache, extras):
     kwargs = {
         'uri': row.uri,
         'name': row.name,
@@ -421,44 +1483,40 @@ def _track(row):
         'last_modified': row.last_modified
     }
     if row.album_uri is not None:
-        if row.albumartist_uri is not None:
-            albumartists = [Artist(
-                uri=row.albumartist_uri,
-                name=row.albumartist_name,
-                sortname=row.albumartist_sortname,
-                musicbrainz_id=row.albumartist_musicbrainz_id
-            )]
-        else:
-            albumartists = None
-        kwargs['album'] = Album(
-            uri=row.album_uri,
-            name=row.album_name,
-            artists=albumartists,
-            num_tracks=row.album_num_tracks,
-            num_discs=row.album_num_discs,
-            date=row.album_date,
-            musicbrainz_id=row.album_musicbrainz_id,
-            images=row.album_images.split() if row.album_images else None
-        )
+        kwargs['album'] = _album(row, cache, extras.get('albumartist', []))
     if row.artist_uri is not None:
-        kwargs['artists'] = [Artist(
-            uri=row.artist_uri,
-            name=row.artist_name,
-            sortname=row.artist_sortname,
-            musicbrainz_id=row.artist_musicbrainz_id
-        )]
+        kwargs['artists'] = [_artist(row, 'artist', cache)]
+        kwargs['artists'].extend(extras.get('artist', []))
     if row.composer_uri is not None:
-        kwargs['composers'] = [Artist(
-            uri=row.composer_uri,
-            name=row.composer_name,
-            sortname=row.composer_sortname,
-            musicbrainz_id=row.composer_musicbrainz_id
-        )]
+        kwargs['composers'] = [_artist(row, 'composer', cache)]
+        kwargs['composers'].extend(extras.get('composer', []))
     if row.performer_uri is not None:
-        kwargs['performers'] = [Artist(
-            uri=row.performer_uri,
-            name=row.performer_name,
-            sortname=row.performer_sortname,
-            musicbrainz_id=row.performer_musicbrainz_id
-        )]
+        kwargs['performers'] = [_artist(row, 'performer', cache)]
+        kwargs['performers'].extend(extras.get('performer', []))
     return Track(**kwargs)
+
+
+def _build_album(row, cache, extras):
+    if row.albumartist_uri is not None:
+        albumartists = [_artist(row, 'albumartist', cache)] + extras
+    else:
+        albumartists = None
+    return Album(
+        uri=row.album_uri,
+        name=row.album_name,
+        artists=albumartists,
+        num_tracks=row.album_num_tracks,
+        num_discs=row.album_num_discs,
+        date=row.album_date,
+        musicbrainz_id=row.album_musicbrainz_id,
+        images=row.album_images.split() if row.album_images else None
+    )
+
+
+def _build_artist(row, role):
+    return Artist(
+        uri=getattr(row, role + '_uri'),
+        name=getattr(row, role + '_name'),
+        sortname=getattr(row, role + '_sortname'),
+        musicbrainz_id=getattr(row, role + '_musicbrainz_id')
+    )
@@ -2,34 +2,42 @@
 
 BEGIN EXCLUSIVE TRANSACTION;
 
-PRAGMA user_version = 6;                -- schema version
+PRAGMA user_version = 20;               -- schema version
+
+-- Library tables; all relations reference integer keys
 
 CREATE TABLE artist (
-    uri             TEXT PRIMARY KEY,   -- artist URI
+    id              INTEGER PRIMARY KEY, -- artist key
+    uri             TEXT NOT NULL UNIQUE, -- artist URI
     name            TEXT NOT NULL,      -- artist name
     sortname        TEXT,               -- artist name for sorting
-    musicbrainz_id  TEXT                -- MusicBrainz ID
+    musicbrainz_id  TEXT,               -- MusicBrainz ID
+    sortkey         TEXT,               -- normalized name for sorting
+    sortname_key    TEXT                -- normalized sortname or name
 );
 
 CREATE TABLE album (
-    uri             TEXT PRIMARY KEY,   -- album URI
+    id              INTEGER PRIMARY KEY, -- album key
+    uri             TEXT NOT NULL UNIQUE, -- album URI
     name            TEXT NOT NULL,      -- album name
-    artists         TEXT,               -- (list of Artist) album artists
+    artists         INTEGER,            -- (list of Artist) album artists
     num_tracks      INTEGER,            -- number of tracks in album
     num_discs       INTEGER,            -- number of discs in album
     date            TEXT,               -- album release date (YYYY or YYYY-MM-DD)
     musicbrainz_id  TEXT,               -- MusicBrainz ID
     images          TEXT,               -- (list of strings) album image URIs
-    FOREIGN KEY (artists) REFERENCES artist (uri)
+    sortkey         TEXT,               -- normalized name for sorting
+    FOREIGN KEY (artists) REFERENCES artist (id)
 );
 
 CREATE TABLE track (
-    uri             TEXT PRIMARY KEY,   -- track URI
+    id              INTEGER PRIMARY KEY, -- track key, also search docid
+    uri             TEXT NOT NULL UNIQUE, -- track URI
     name            TEXT NOT NULL,      -- track name
-    album           TEXT,               -- track album
-    artists         TEXT,               -- (list of Artist) – track artists
-    composers       TEXT,               -- (list of Artist) – track composers
-    performers      TEXT,               -- (list of Artist) – track performers
+    album           INTEGER,            -- track album
+    artists         INTEGER,            -- (list of Artist) – track artists
+    composers       INTEGER,            -- (list of Artist) – track composers
+    performers      INTEGER,            -- (list of Artist) – track performers
     genre           TEXT,               -- track genre
     track_no        INTEGER,            -- track number in album
     disc_no         INTEGER,            -- disc number in album
@@ -39,10 +47,13 @@ CREATE TABLE track (
     comment         TEXT,               -- track comment
     musicbrainz_id  TEXT,               -- MusicBrainz ID
     last_modified   INTEGER,            -- Represents last modification time
-    FOREIGN KEY (album) REFERENCES album (uri),
-    FOREIGN KEY (artists) REFERENCES artist (uri),
-    FOREIGN KEY (composers) REFERENCES artist (uri),
-    FOREIGN KEY (performers) REFERENCES artist (uri)
+    sortkey         TEXT,               -- normalized name for sorting
+    datekey         INTEGER,            -- track or album date as YYYYMMDD
+    extra_artists   INTEGER NOT NULL DEFAULT 0, -- number of additional artists
+    FOREIGN KEY (album) REFERENCES album (id),
+    FOREIGN KEY (artists) REFERENCES artist (id),
+    FOREIGN KEY (composers) REFERENCES artist (id),
+    FOREIGN KEY (performers) REFERENCES artist (id)
 );
 
 CREATE INDEX album_name_index           ON album (name);
@@ -56,10 +67,22 @@ CREATE INDEX track_composers_index      ON track (composers);
 CREATE INDEX track_performers_index     ON track (performers);
 CREATE INDEX track_genre_index          ON track (genre);
 CREATE INDEX track_track_no_index       ON track (track_no);
-CREATE INDEX track_date_index           ON track (date);
 CREATE INDEX track_comment_index        on track (comment);
 CREATE INDEX track_last_modified_index  on track (last_modified);
 
+-- Sort keys are case and diacritic folded names without leading articles,
+-- computed by schema.insert_tracks(); indexes match browse ORDER BY clauses
+
+CREATE INDEX album_sortkey_index        ON album (sortkey, uri);
+CREATE INDEX artist_sortkey_index       ON artist (sortkey, uri);
+CREATE INDEX artist_sortname_key_index  ON artist (sortname_key, uri);
+CREATE INDEX track_sortkey_index        ON track (sortkey, uri);
+
+-- Date keys have zero month or day if unknown, so date prefixes map to
+-- key ranges, e.g. 2015-03 to [20150300, 20150400)
+
+CREATE INDEX track_datekey_index        ON track (datekey, album);
+
 -- Convenience views
 
 CREATE VIEW albums AS
@@ -75,10 +98,10 @@ SELECT album.uri                        AS uri,
        album.musicbrainz_id             AS musicbrainz_id,
        album.images                     AS images
   FROM album
-  LEFT OUTER JOIN artist                ON album.artists = artist.uri;
+  LEFT OUTER JOIN artist                ON album.artists = artist.id;
 
 CREATE VIEW tracks AS
-SELECT track.rowid                      AS docid,
+SELECT track.id                         AS docid,
        track.uri                        AS uri,
        track.name                       AS name,
        track.genre                      AS genre,
@@ -90,6 +113,7 @@ SELECT track.rowid                      AS docid,
        track.comment                    AS comment,
        track.musicbrainz_id             AS musicbrainz_id,
        track.last_modified              AS last_modified,
+       track.extra_artists              AS extra_artists,
        album.uri                        AS album_uri,
        album.name                       AS album_name,
        album.num_tracks                 AS album_num_tracks,
@@ -114,32 +138,82 @@ SELECT track.rowid                      AS docid,
        albumartist.sortname             AS albumartist_sortname,
        albumartist.musicbrainz_id       AS albumartist_musicbrainz_id
   FROM track
-  LEFT OUTER JOIN album                 ON track.album = album.uri
-  LEFT OUTER JOIN artist                ON track.artists = artist.uri
-  LEFT OUTER JOIN artist AS composer    ON track.composers = composer.uri
-  LEFT OUTER JOIN artist AS performer   ON track.performers = performer.uri
-  LEFT OUTER JOIN artist AS albumartist ON album.artists = albumartist.uri;
+  LEFT OUTER JOIN album                 ON track.album = album.id
+  LEFT OUTER JOIN artist                ON track.artists = artist.id
+  LEFT OUTER JOIN artist AS composer    ON track.composers = composer.id
+  LEFT OUTER JOIN artist AS performer   ON track.performers = performer.id
+  LEFT OUTER JOIN artist AS albumartist ON album.artists = albumartist.id;
+
+-- Search table rows; names of multiple artists are separated by "; "
+
+CREATE VIEW search_rows AS
+SELECT track.id                         AS docid,
+       track.uri                        AS uri,
+       track.name                       AS track_name,
+       album.name                       AS album,
+       (SELECT group_concat(name, '; ') FROM (
+            SELECT artist.name AS name
+              FROM artist_link JOIN artist ON artist_link.artist = artist.id
+             WHERE artist_link.track = track.id
+               AND artist_link.role = 'artist'
+             ORDER BY artist_link.position
+       ))                               AS artist,
+       (SELECT group_concat(name, '; ') FROM (
+            SELECT artist.name AS name
+              FROM artist_link JOIN artist ON artist_link.artist = artist.id
+             WHERE artist_link.track = track.id
+               AND artist_link.role = 'composer'
+             ORDER BY artist_link.position
+       ))                               AS composer,
+       (SELECT group_concat(name, '; ') FROM (
+            SELECT artist.name AS name
+              FROM artist_link JOIN artist ON artist_link.artist = artist.id
+             WHERE artist_link.track = track.id
+               AND artist_link.role = 'performer'
+             ORDER BY artist_link.position
+       ))                               AS performer,
+       (SELECT group_concat(name, '; ') FROM (
+            SELECT artist.name AS name
+              FROM artist_link JOIN artist ON artist_link.artist = artist.id
+             WHERE artist_link.track = track.id
+               AND artist_link.role = 'albumartist'
+             ORDER BY artist_link.position
+       ))                               AS albumartist,
+       track.genre                      AS genre,
+       track.track_no                   AS track_no,
+       coalesce(track.date, album.date) AS date,
+       track.comment                    AS comment
+  FROM track
+  LEFT OUTER JOIN album                 ON track.album = album.id;
 
 -- Indexed search; column names match Mopidy query fields
 
-CREATE VIEW search AS
-SELECT docid                            AS docid,
-       uri                              AS uri,
-       name                             AS track_name,
-       album_name                       AS album,
-       artist_name                      AS artist,
-       composer_name                    AS composer,
-       performer_name                   AS performer,
-       albumartist_name                 AS albumartist,
-       genre                            AS genre,
-       track_no                         AS track_no,
-       coalesce(date, album_date)       AS date,
-       comment                          AS comment
- FROM tracks;
+CREATE TABLE search (
+    docid           INTEGER PRIMARY KEY, -- track key
+    uri             TEXT NOT NULL,      -- track URI
+    track_name      TEXT NOT NULL,      -- track name
+    album           TEXT,               -- album name
+    artist          TEXT,               -- artist name
+    composer        TEXT,               -- composer name
+    performer       TEXT,               -- performer name
+    albumartist     TEXT,               -- album artist name
+    genre           TEXT,               -- track genre
+    track_no        INTEGER,            -- track number in album
+    date            TEXT,               -- track or album release date
+    comment         TEXT                -- track comment
+);
+
+CREATE INDEX search_uri_index           ON search (uri);
+CREATE INDEX search_track_name_index    ON search (track_name);
+CREATE INDEX search_album_index         ON search (album);
+CREATE INDEX search_genre_index         ON search (genre);
+CREATE INDEX search_track_no_index      ON search (track_no);
+CREATE INDEX search_date_index          ON search (date);
+CREATE INDEX search_comment_index       ON search (comment);
 
 -- Full-text search; column names match Mopidy query fields
 
-CREATE VIRTUAL TABLE fts USING fts3 (
+CREATE VIRTUAL TABLE fts USING fts5 (
     uri,
     track_name,
     album,
@@ -150,12 +224,120 @@ CREATE VIRTUAL TABLE fts USING fts3 (
     genre,
     track_no,
     date,
-    comment
+    comment,
+    content = 'search',
+    content_rowid = 'docid',
+    prefix = '2 3',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+-- Albums and artists of replaced or deleted tracks and albums, which
+-- may have become orphaned; checked and emptied by schema.cleanup()
+
+CREATE TABLE dirty (
+    type            TEXT NOT NULL,      -- album or artist
+    id              INTEGER NOT NULL,   -- album or artist key
+    PRIMARY KEY (type, id)
+) WITHOUT ROWID;
+
+-- Name tokens for search-as-you-type suggestions; maintained by
+-- schema.insert_tracks(), since tokenizing is done in Python
+
+CREATE TABLE term (
+    type            TEXT NOT NULL,      -- artist, album or track
+    term            TEXT NOT NULL,      -- folded name token
+    id              INTEGER NOT NULL,   -- artist, album or track key
+    PRIMARY KEY (type, term, id)
+) WITHOUT ROWID;
+
+CREATE INDEX term_id_index              ON term (type, id);
+
+CREATE TRIGGER artist_before_insert BEFORE INSERT ON artist
+BEGIN
+    DELETE FROM term
+     WHERE type = 'artist'
+       AND id = (SELECT id FROM artist WHERE uri = new.uri);
+END;
+
+CREATE TRIGGER artist_after_delete AFTER DELETE ON artist
+BEGIN
+    DELETE FROM term WHERE type = 'artist' AND id = old.id;
+END;
+
+CREATE TRIGGER album_before_insert BEFORE INSERT ON album
+BEGIN
+    DELETE FROM term
+     WHERE type = 'album'
+       AND id = (SELECT id FROM album WHERE uri = new.uri);
+    INSERT OR IGNORE INTO dirty (type, id)
+    SELECT 'artist', artist.id
+      FROM album JOIN artist ON album.artists = artist.id
+     WHERE album.uri = new.uri;
+END;
+
+CREATE TRIGGER album_after_delete AFTER DELETE ON album
+BEGIN
+    DELETE FROM term WHERE type = 'album' AND id = old.id;
+    INSERT OR IGNORE INTO dirty (type, id)
+    SELECT 'artist', id FROM artist WHERE id = old.artists;
+END;
+
+CREATE TRIGGER track_before_insert BEFORE INSERT ON track
+BEGIN
+    DELETE FROM term
+     WHERE type = 'track'
+       AND id = (SELECT id FROM track WHERE uri = new.uri);
+    INSERT OR IGNORE INTO dirty (type, id)
+    SELECT 'album', album.id
+      FROM track JOIN album ON track.album = album.id
+     WHERE track.uri = new.uri
+     UNION ALL
+    SELECT 'artist', artist.id
+      FROM track JOIN artist ON artist.id IN (
+        track.artists, track.composers, track.performers
+    )
+     WHERE track.uri = new.uri;
+END;
+
+CREATE TRIGGER track_after_delete AFTER DELETE ON track
+BEGIN
+    DELETE FROM term WHERE type = 'track' AND id = old.id;
+    INSERT OR IGNORE INTO dirty (type, id)
+    SELECT 'album', id FROM album WHERE id = old.album
+     UNION ALL
+    SELECT 'artist', id FROM artist WHERE id IN (
+        old.artists, old.composers, old.performers
+    );
+END;
+
+-- Bulk mode: while this table is not empty, the search tables are not
+-- maintained by triggers, but updated in a single pass at the end
+
+CREATE TABLE bulk (
+    started         INTEGER             -- start time in milliseconds
 );
 
 CREATE TRIGGER track_after_insert AFTER INSERT ON track
+WHEN NOT EXISTS (SELECT * FROM bulk)
 BEGIN
+    -- remove stale entries for tracks replaced by INSERT OR REPLACE
     INSERT INTO fts (
+        fts,
+        rowid,
+        uri,
+        track_name,
+        album,
+        artist,
+        composer,
+        performer,
+        albumartist,
+        genre,
+        track_no,
+        date,
+        comment
+    ) SELECT 'delete', * FROM search WHERE uri = new.uri;
+    DELETE FROM search WHERE uri = new.uri;
+    INSERT INTO search (
         docid,
         uri,
         track_name,
@@ -168,12 +350,27 @@ BEGIN
         track_no,
         date,
         comment
-    ) SELECT * FROM search WHERE docid = new.rowid;
+    ) SELECT * FROM search_rows WHERE docid = new.id;
+    INSERT INTO fts (
+        rowid,
+        uri,
+        track_name,
+        album,
+        artist,
+        composer,
+        performer,
+        albumartist,
+        genre,
+        track_no,
+        date,
+        comment
+    ) SELECT * FROM search WHERE docid = new.id;
 END;
 
 CREATE TRIGGER track_after_update AFTER UPDATE ON track
+WHEN NOT EXISTS (SELECT * FROM bulk)
 BEGIN
-    INSERT INTO fts (
+    INSERT INTO search (
         docid,
         uri,
         track_name,
@@ -186,17 +383,175 @@ BEGIN
         track_no,
         date,
         comment
-    ) SELECT * FROM search WHERE docid = new.rowid;
+    ) SELECT * FROM search_rows WHERE docid = new.id;
+    INSERT INTO fts (
+        rowid,
+        uri,
+        track_name,
+        album,
+        artist,
+        composer,
+        performer,
+        albumartist,
+        genre,
+        track_no,
+        date,
+        comment
+    ) SELECT * FROM search WHERE docid = new.id;
 END;
 
 CREATE TRIGGER track_before_update BEFORE UPDATE ON track
+WHEN NOT EXISTS (SELECT * FROM bulk)
 BEGIN
-    DELETE FROM fts WHERE docid = old.rowid;
+    INSERT INTO fts (
+        fts,
+        rowid,
+        uri,
+        track_name,
+        album,
+        artist,
+        composer,
+        performer,
+        albumartist,
+        genre,
+        track_no,
+        date,
+        comment
+    ) SELECT 'delete', * FROM search WHERE docid = old.id;
+    DELETE FROM search WHERE docid = old.id;
 END;
 
 CREATE TRIGGER track_before_delete BEFORE DELETE ON track
+WHEN NOT EXISTS (SELECT * FROM bulk)
+BEGIN
+    INSERT INTO fts (
+        fts,
+        rowid,
+        uri,
+        track_name,
+        album,
+        artist,
+        composer,
+        performer,
+        albumartist,
+        genre,
+        track_no,
+        date,
+        comment
+    ) SELECT 'delete', * FROM search WHERE docid = old.id;
+    DELETE FROM search WHERE docid = old.id;
+END;
+
+-- Browse summaries; column names match track and browse query fields
+
+CREATE TABLE genre_count (
+    genre           TEXT PRIMARY KEY,   -- track genre
+    count           INTEGER NOT NULL    -- number of tracks
+) WITHOUT ROWID;
+
+CREATE TABLE date_count (
+    datekey         INTEGER PRIMARY KEY, -- track or album date key
+    count           INTEGER NOT NULL    -- number of tracks
+) WITHOUT ROWID;
+
+CREATE TABLE artist_role (
+    role            TEXT NOT NULL,      -- artist, composer, performer or albumartist
+    artist          INTEGER NOT NULL,   -- artist key
+    count           INTEGER NOT NULL,   -- number of tracks
+    PRIMARY KEY (role, artist)
+) WITHOUT ROWID;
+
+CREATE INDEX genre_count_nocase_index   ON genre_count (genre COLLATE NOCASE);
+
+CREATE TRIGGER track_after_insert_count AFTER INSERT ON track
+WHEN NOT EXISTS (SELECT * FROM bulk)
+BEGIN
+    INSERT INTO genre_count (genre, count)
+    SELECT new.genre, 1 WHERE new.genre IS NOT NULL
+    ON CONFLICT (genre) DO UPDATE SET count = count + 1;
+    INSERT INTO date_count (datekey, count)
+    SELECT new.datekey, 1 WHERE new.datekey IS NOT NULL
+    ON CONFLICT (datekey) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER track_before_insert_count BEFORE INSERT ON track
+WHEN NOT EXISTS (SELECT * FROM bulk)
+BEGIN
+    -- uncount tracks replaced by INSERT OR REPLACE
+    UPDATE genre_count SET count = count - 1
+     WHERE genre = (SELECT genre FROM track WHERE uri = new.uri);
+    UPDATE date_count SET count = count - 1
+     WHERE datekey = (SELECT datekey FROM track WHERE uri = new.uri);
+    DELETE FROM genre_count
+     WHERE genre = (SELECT genre FROM track WHERE uri = new.uri)
+       AND count = 0;
+    DELETE FROM date_count
+     WHERE datekey = (SELECT datekey FROM track WHERE uri = new.uri)
+       AND count = 0;
+END;
+
+CREATE TRIGGER track_after_delete_count AFTER DELETE ON track
+WHEN NOT EXISTS (SELECT * FROM bulk)
+BEGIN
+    UPDATE genre_count SET count = count - 1 WHERE genre = old.genre;
+    UPDATE date_count SET count = count - 1 WHERE datekey = old.datekey;
+    DELETE FROM genre_count WHERE genre = old.genre AND count = 0;
+    DELETE FROM date_count WHERE datekey = old.datekey AND count = 0;
+END;
+
+-- Artist roles of tracks, written by schema.insert_tracks() before the
+-- tracks themselves, so track keys are not declared as foreign keys;
+-- column names match browse query fields
+
+CREATE TABLE artist_link (
+    artist          INTEGER NOT NULL,   -- artist key
+    role            TEXT NOT NULL,      -- artist, composer, performer or albumartist
+    track           INTEGER NOT NULL,   -- track key
+    album           INTEGER,            -- track album key
+    position        INTEGER NOT NULL DEFAULT 0, -- artist position in role
+    PRIMARY KEY (artist, role, track)
+) WITHOUT ROWID;
+
+CREATE INDEX artist_link_albums_index   ON artist_link (artist, role, album);
+CREATE INDEX artist_link_album_index    ON artist_link (album, role);
+CREATE INDEX artist_link_track_index    ON artist_link (track, role, position);
+
+CREATE TRIGGER track_after_delete_link AFTER DELETE ON track
+BEGIN
+    DELETE FROM artist_link WHERE track = old.id;
+END;
+
+CREATE TRIGGER album_after_insert_link AFTER INSERT ON album
+BEGIN
+    -- first album artist of existing tracks may have changed
+    DELETE FROM artist_link
+     WHERE album = new.id AND role = 'albumartist' AND position = 0;
+    INSERT OR IGNORE INTO artist_link (artist, role, track, album)
+    SELECT new.artists, 'albumartist', id, new.id
+      FROM track
+     WHERE album = new.id AND new.artists IS NOT NULL;
+END;
+
+CREATE TRIGGER artist_link_after_delete AFTER DELETE ON artist_link
+BEGIN
+    INSERT OR IGNORE INTO dirty (type, id) VALUES ('artist', old.artist);
+END;
+
+CREATE TRIGGER artist_link_after_insert_count AFTER INSERT ON artist_link
+WHEN NOT EXISTS (SELECT * FROM bulk)
+BEGIN
+    INSERT INTO artist_role (role, artist, count)
+    VALUES (new.role, new.artist, 1)
+    ON CONFLICT (role, artist) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER artist_link_after_delete_count AFTER DELETE ON artist_link
+WHEN NOT EXISTS (SELECT * FROM bulk)
 BEGIN
-    DELETE FROM fts WHERE docid = old.rowid;
+    UPDATE artist_role SET count = count - 1
+     WHERE role = old.role AND artist = old.artist;
+    DELETE FROM artist_role
+     WHERE role = old.role AND artist = old.artist AND count = 0;
 END;
 
 END TRANSACTION;
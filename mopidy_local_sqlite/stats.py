@@ -0,0 +1,93 @@
+from __future__ import unicode_literals
+
+import bisect
+import contextlib
+import threading
+import time
+
+# upper bounds of latency histogram buckets in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Counter(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.steps = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def __str__(self):
+        labels = ['<=%d' % ms for ms in BUCKETS] + ['>%d' % BUCKETS[-1]]
+        return '%d calls, %.1f ms avg, %.1f ms max, %d rows, %d steps [%s]' % (
+            self.count, self.total / self.count, self.max, self.rows,
+            self.steps, ' '.join(
+                '%s:%d' % (label, n)
+                for label, n in zip(labels, self.histogram) if n
+            )
+        )
+
+    def add(self, ms, rows, steps):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.rows += rows
+        self.steps += steps
+        self.histogram[bisect.bisect_left(BUCKETS, ms)] += 1
+
+
+class Sample(object):
+
+    def __init__(self):
+        self.ms = None
+        self.rows = 0
+        self.steps = 0
+        self.statements = []
+
+
+class Stats(object):
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __iter__(self):
+        with self._lock:
+            return iter(sorted(self._counters.items()))
+
+    def __len__(self):
+        return len(self._counters)
+
+    def step(self):
+        # SQLite progress handler; returns None to continue
+        sample = getattr(self._local, 'sample', None)
+        if sample is not None:
+            sample.steps += 1
+
+    def trace(self, sql, params=()):
+        sample = getattr(self._local, 'sample', None)
+        if sample is not None:
+            sample.statements.append((sql, params))
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        outer = getattr(self._local, 'sample', None)
+        self._local.sample = sample = Sample()
+        start = time.time()
+        try:
+            yield sample
+        finally:
+            sample.ms = (time.time() - start) * 1000
+            self._local.sample = outer
+            with self._lock:
+                counter = self._counters.get(name)
+                if counter is None:
+                    counter = self._counters[name] = Counter()
+                counter.add(sample.ms, sample.rows, sample.steps)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from mopidy_local_sqlite import cache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_get_put(self):
+        c = cache.LRUCache(2)
+        self.assertIsNone(c.get('a'))
+        c.put('a', 1)
+        self.assertEqual(1, c.get('a'))
+        self.assertEqual(1, c.hits)
+        self.assertEqual(1, c.misses)
+
+    def test_maxsize(self):
+        c = cache.LRUCache(2)
+        c.put('a', 1)
+        c.put('b', 2)
+        c.get('a')
+        c.put('c', 3)
+        self.assertEqual(2, len(c))
+        self.assertEqual(1, c.get('a'))
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(3, c.get('c'))
+
+    def test_clear(self):
+        c = cache.LRUCache(2)
+        c.put('a', 1)
+        c.clear()
+        self.assertEqual(0, len(c))
+        self.assertIsNone(c.get('a'))
@@ -15,6 +15,17 @@ def test_get_config_schema():
     schema = ext.get_config_schema()
     assert 'directories' in schema
     assert 'timeout' in schema
+    assert 'pool_size' in schema
+    assert 'batch_size' in schema
+    assert 'model_cache_size' in schema
+    assert 'result_cache_size' in schema
+    assert 'slow_query_threshold' in schema
+    assert 'journal_mode' in schema
+    assert 'synchronous' in schema
+    assert 'cache_size' in schema
+    assert 'mmap_size' in schema
+    assert 'temp_store' in schema
+    assert 'wal_autocheckpoint' in schema
     assert 'use_album_mbid_uri' in schema
     assert 'use_artist_mbid_uri' in schema
     assert 'use_artist_sortname' in schema
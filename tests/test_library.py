@@ -1,11 +1,12 @@
 from __future__ import unicode_literals
 
 import shutil
+import sqlite3
 import tempfile
 import unittest
 
 from mopidy.local import translator
-from mopidy.models import SearchResult, Track
+from mopidy.models import Album, Artist, Ref, SearchResult, Track
 
 from mopidy_local_sqlite import library
 
@@ -14,18 +15,30 @@ class LocalLibraryProviderTest(unittest.TestCase):
 
     config = {
         'local-sqlite': {
+            'batch_size': 2,
+            'cache_size': None,
             'directories': [],
             'encodings': ['utf-8', 'latin-1'],
+            'journal_mode': 'wal',
+            'mmap_size': None,
+            'model_cache_size': 10,
+            'pool_size': 2,
+            'result_cache_size': 10,
+            'search_limit': None,
+            'slow_query_threshold': None,
+            'synchronous': 'normal',
+            'temp_store': None,
             'timeout': 1.0,
             'use_album_mbid_uri': False,
             'use_artist_mbid_uri': False,
-            'search_limit': None
+            'use_artist_sortname': False,
+            'wal_autocheckpoint': None
         }
     }
 
     def setUp(self):
         self.tempdir = tempfile.mkdtemp()
-        self.library = library.SQLiteLibrary(dict(
+        self.library_config = dict(
             self.config,
             core={
                 'data_dir': self.tempdir,
@@ -35,7 +48,8 @@ class LocalLibraryProviderTest(unittest.TestCase):
                 'data_dir': self.tempdir,
                 'excluded_file_extensions': []
             }
-        ))
+        )
+        self.library = library.SQLiteLibrary(self.library_config)
         self.library.load()
 
     def tearDown(self):
@@ -59,6 +73,163 @@ class LocalLibraryProviderTest(unittest.TestCase):
         self.library.close()
         self.assertEqual([track], self.library.lookup(uri))
 
+    def test_begin(self):
+        track = Track(uri='local:track:track.mp3', last_modified=1)
+        self.assertEqual([], list(self.library.begin()))
+        self.library.add(track)
+        self.library.close()
+        self.assertEqual([(track.uri, track.last_modified)], [
+            (t.uri, t.last_modified) for t in self.library.begin()
+        ])
+        self.library.close()
+
+    def test_begin_interrupted(self):
+        track = Track(uri='local:track:track.mp3', name='track')
+        self.library.begin()
+        self.library.add(track)
+        self.library.flush()
+        # scan dies before close(); next load() finishes the update
+        self.library = library.SQLiteLibrary(self.library_config)
+        self.assertEqual(1, self.library.load())
+        with self.library._reader() as c:
+            self.assertFalse(c.execute('SELECT * FROM bulk').fetchall())
+        self.assertEqual([track], list(self.library.search(
+            {'track_name': ['track']}, exact=True
+        ).tracks))
+
+    def test_close_readers(self):
+        track = Track(uri='local:track:track.mp3', name='track')
+        with self.library._reader() as reader:
+            pass
+        self.library.begin()
+        self.library.add(track)
+        self.library.close()
+        self.assertRaises(sqlite3.ProgrammingError, reader.execute, 'SELECT 1')
+        self.assertEqual([track], self.library.lookup(track.uri))
+
+    def test_journal_mode(self):
+        with self.library._reader() as c:
+            mode = c.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual('wal', mode)
+
+    def test_add_batch(self):
+        tracks = [Track(uri='local:track:%d.mp3' % i) for i in range(3)]
+        self.library.begin()
+        self.library.add(tracks[0])
+        self.assertEqual(0, self.library.load())
+        self.library.add(tracks[1])
+        self.assertEqual(2, self.library.load())
+        self.library.add(tracks[2])
+        self.assertEqual(2, self.library.load())
+        self.library.flush()
+        self.assertEqual(3, self.library.load())
+        self.library.close()
+
+    def test_add_transaction(self):
+        tracks = [Track(uri='local:track:%d.mp3' % i) for i in range(3)]
+        self.library.begin()
+        self.library.add(tracks[0])
+        self.library.flush()
+        # batches and removals are committed on flush only
+        self.library.add(tracks[1])
+        self.library.add(tracks[2])
+        self.library.remove(tracks[0].uri)
+        with self.library._reader() as c:
+            self.assertEqual([tracks[0].uri], [
+                row.uri for row in c.execute('SELECT uri FROM track')
+            ])
+        self.library.flush()
+        with self.library._reader() as c:
+            self.assertEqual([tracks[1].uri, tracks[2].uri], [
+                row.uri for row in c.execute('SELECT uri FROM track')
+            ])
+        self.library.close()
+
+    def test_add_batch_error(self):
+        track = Track(uri='local:track:track.mp3', name='track')
+        # non-ASCII byte strings cannot be bound as SQLite text
+        invalid = Track(
+            uri='local:track:invalid.mp3', name=b'invalid \xff',
+            album=Album(name='album'), artists=[Artist(name='artist')]
+        )
+        self.library.begin()
+        self.library.add(invalid)
+        self.library.add(track)
+        self.library.flush()
+        c = self.library._connect()
+        self.assertEqual([track.uri], [
+            row.uri for row in c.execute('SELECT uri FROM track')
+        ])
+        for table in ('album', 'artist', 'artist_link'):
+            self.assertEqual(0, c.execute(
+                'SELECT count(*) FROM %s' % table
+            ).fetchone()[0])
+        self.library.close()
+        self.assertEqual([track], self.library.lookup(track.uri))
+
+    def test_add_replace(self):
+        track = Track(uri='local:track:track.mp3', name='track')
+        self.library.begin()
+        self.library.add(track)
+        self.library.close()
+        self.assertEqual([track], self.library.lookup(track.uri))
+        track = track.copy(name='new track')
+        self.library.begin()
+        self.library.add(track)
+        self.library.close()
+        self.assertEqual([track], self.library.lookup(track.uri))
+
+    def test_browse_paginated(self):
+        tracks = [Track(uri='local:track:%d.mp3' % i) for i in range(3)]
+        self.library.begin()
+        for track in tracks:
+            self.library.add(track)
+        self.library.close()
+        refs = self.library.browse('local:directory?type=track&limit=2')
+        self.assertEqual(3, len(refs))
+        self.assertEqual([t.uri for t in tracks[0:2]], [
+            ref.uri for ref in refs[0:2]
+        ])
+        self.assertEqual(Ref.DIRECTORY, refs[2].type)
+        refs = self.library.browse(refs[2].uri)
+        self.assertEqual([t.uri for t in tracks[2:3]], [
+            ref.uri for ref in refs
+        ])
+
+    def test_browse_artists_paginated(self):
+        artists = [Artist(name='Artist %d' % i) for i in range(5)]
+        self.library.begin()
+        for i, artist in enumerate(artists):
+            self.library.add(Track(
+                uri='local:track:%d.mp3' % i,
+                album=Album(name='Album %d' % i, artists=[artist]),
+                artists=[artist] if i % 2 else []
+            ))
+        self.library.close()
+        names, uri = [], 'local:directory?type=artist&limit=2'
+        while uri is not None:
+            refs = self.library.browse(uri)
+            if refs[-1].type == Ref.DIRECTORY:
+                uri = refs.pop().uri
+            else:
+                uri = None
+            self.assertLessEqual(len(refs), 2)
+            names.extend(ref.name for ref in refs)
+            self.assertLessEqual(len(names), len(artists))
+        self.assertEqual([artist.name for artist in artists], names)
+
+    def test_suggest(self):
+        track = Track(uri='local:track:track.mp3', name='Bj\xf6rk Song')
+        self.library.begin()
+        self.library.add(track)
+        self.library.close()
+        self.assertEqual(
+            [Ref.track(uri=track.uri, name=track.name)],
+            self.library.suggest('bjo')
+        )
+        self.assertEqual([], self.library.suggest('son bjo'))
+        self.assertEqual([], self.library.suggest(''))
+
     def test_clear(self):
         self.library.begin()
         self.library.add(Track(uri='local:track:track.mp3'))
@@ -66,6 +237,54 @@ class LocalLibraryProviderTest(unittest.TestCase):
         self.library.clear()
         self.assertEqual(self.library.load(), 0)
 
+    def test_result_cache(self):
+        track = Track(uri='local:track:track.mp3', name='track')
+        self.library.begin()
+        self.library.add(track)
+        self.library.close()
+        query = {'track_name': ['track']}
+        result = self.library.search(query, exact=True)
+        self.assertEqual([track], list(result.tracks))
+        self.assertIs(result, self.library.search(query, exact=True))
+        self.assertEqual({'track'}, self.library.get_distinct('track_name'))
+        self.assertEqual({'track'}, self.library.get_distinct('track_name'))
+        self.assertEqual(
+            {'hits': 2, 'misses': 2, 'size': 2},
+            self.library.cache_info()['results']
+        )
+        self.library.remove(track.uri)
+        self.library.flush()
+        result = self.library.search(query, exact=True)
+        self.assertEqual([], list(result.tracks))
+        self.assertEqual(set(), self.library.get_distinct('track_name'))
+
+    def test_lookup_many(self):
+        tracks = [
+            Track(uri='local:track:%d.mp3' % i, name='track %d' % i)
+            for i in range(3)
+        ]
+        self.library.begin()
+        for track in tracks:
+            self.library.add(track)
+        self.library.close()
+        uris = [track.uri for track in tracks]
+        self.assertEqual(
+            {uri: [track] for uri, track in zip(uris, tracks)},
+            self.library.lookup_many(uris)
+        )
+        self.assertEqual(
+            {'local:track:foo.mp3': [], 'foo:bar': []},
+            self.library.lookup_many(['local:track:foo.mp3', 'foo:bar'])
+        )
+
+    def test_stats(self):
+        self.library.search({'track_name': ['track']}, exact=True)
+        self.library.lookup('local:track:track.mp3')
+        refs = self.library.browse('local:directory?type=stats')
+        names = [ref.name for ref in refs]
+        self.assertTrue(names[0].startswith('lookup: 1 calls'))
+        self.assertTrue(names[1].startswith('search: 1 calls'))
+
     def test_search_uri(self):
         empty = SearchResult(uri='local:search?')
         self.assertEqual(empty, self.library.search(uris=None))
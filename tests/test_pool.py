@@ -0,0 +1,41 @@
+from __future__ import unicode_literals
+
+import sqlite3
+import unittest
+
+from mopidy_local_sqlite import pool
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+        self.pool = pool.ConnectionPool(self.connect, 2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def connect(self):
+        connection = sqlite3.connect(':memory:')
+        self.connections.append(connection)
+        return connection
+
+    def test_reuse(self):
+        with self.pool.connection() as c:
+            first = c
+        with self.pool.connection() as c:
+            self.assertIs(first, c)
+        self.assertEqual(1, len(self.connections))
+
+    def test_concurrent(self):
+        with self.pool.connection() as c1:
+            with self.pool.connection() as c2:
+                self.assertIsNot(c1, c2)
+        self.assertEqual(2, len(self.connections))
+
+    def test_close(self):
+        with self.pool.connection() as c:
+            pass
+        self.pool.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            c.execute('SELECT 1')
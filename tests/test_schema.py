@@ -46,6 +46,24 @@ class SchemaTest(unittest.TestCase):
         tracks = list(schema.tracks(self.connection))
         self.assertEqual(len(self.tracks), len(tracks))
 
+    def test_last_modified(self):
+        self.assertItemsEqual(
+            [(track.uri, track.last_modified) for track in self.tracks],
+            [(row.uri, row.last_modified) for row in schema.last_modified(
+                self.connection
+            )]
+        )
+
+    def test_insert_tracks(self):
+        c = self.connection
+        schema.clear(c)
+        count = schema.insert_tracks(c, self.tracks)
+        self.assertEqual(len(self.tracks), count)
+        self.assertEqual(len(self.tracks), schema.count_tracks(c))
+        self.assertEqual(3, len(c.execute('SELECT * FROM album').fetchall()))
+        self.assertEqual(2, len(c.execute('SELECT * FROM artist').fetchall()))
+        self.assertItemsEqual(self.tracks, schema.tracks(c))
+
     def test_list_distinct(self):
         self.assertItemsEqual(
             [album.name for album in self.albums],
@@ -75,6 +93,75 @@ class SchemaTest(unittest.TestCase):
             [self.tracks[0].genre],
             schema.list_distinct(self.connection, 'genre')
         )
+        self.assertItemsEqual(
+            [album.name for album in self.albums[1:3]],
+            schema.list_distinct(self.connection, 'album', [
+                ('any', self.artists[0].name)
+            ])
+        )
+
+    def test_replace(self):
+        c = self.connection
+        track = self.tracks[0].copy(name='track #0 (replaced)')
+        schema.insert_track(c, track)
+        self.assertEqual([track], list(schema.lookup(c, Ref.TRACK, track.uri)))
+        self.assertNotIn(
+            self.tracks[0].name, schema.list_distinct(c, 'track_name')
+        )
+        self.assertEqual(
+            [track.uri],
+            [t.uri for t in schema.search_tracks(c, [
+                ('track_name', 'replaced')
+            ], 10, 0, False)]
+        )
+
+    def test_replace_album(self):
+        c = self.connection
+        album = self.albums[1].copy(name='album #1 (replaced)')
+        key = c.execute('SELECT id FROM album WHERE uri = ?', [album.uri])
+        key = key.fetchone()[0]
+        schema.insert_album(c, album)
+        self.assertEqual(
+            [self.tracks[3].copy(album=album)],
+            list(schema.lookup(c, Ref.TRACK, self.tracks[3].uri))
+        )
+        self.assertEqual(key, c.execute(
+            'SELECT album FROM track WHERE uri = ?', [self.tracks[3].uri]
+        ).fetchone()[0])
+
+    def test_suggest(self):
+        with self.connection as c:
+            self.assertEqual([
+                Ref.artist(uri='local:artist:0', name='artist #0'),
+                Ref.album(uri='local:album:0', name='album #0'),
+                Ref.track(uri='local:track:0', name='track #0'),
+            ], schema.suggest(c, '0', 1))
+            self.assertEqual([
+                Ref.artist(uri='local:artist:1', name='artist #1'),
+            ], schema.suggest(c, 'ARTIST #1', 10))
+            self.assertEqual(5, len(schema.suggest(c, 'tr', 10)))
+            self.assertEqual(2, len(schema.suggest(c, 'tr', 2)))
+        schema.delete_track(self.connection, 'local:track:0')
+        schema.insert_track(self.connection, Track(
+            uri='local:track:1', name='renamed'
+        ))
+        with self.connection as c:
+            self.assertEqual(3, len(schema.suggest(c, 'track', 10)))
+
+    def test_suggest_bytes(self):
+        schema.insert_track(self.connection, Track(
+            uri='local:track:Test.mp3', name=b'Test.mp3'
+        ))
+        with self.connection as c:
+            self.assertEqual([
+                Ref.track(uri='local:track:Test.mp3', name='Test.mp3')
+            ], schema.suggest(c, 'test', 10))
+            terms = c.execute("""
+            SELECT term
+              FROM term JOIN track USING (id)
+             WHERE type = 'track' AND uri = ?
+            """, ['local:track:Test.mp3'])
+            self.assertItemsEqual(['test', 'mp3'], [row.term for row in terms])
 
     def test_lookup_track(self):
         with self.connection as c:
@@ -101,6 +188,35 @@ class SchemaTest(unittest.TestCase):
             result = schema.lookup(c, Ref.ARTIST, self.artists[1].uri)
             self.assertEqual([self.tracks[4]], list(result))
 
+            result = schema.lookup(c, Ref.ARTIST, self.artists[0].uri,
+                                   role=('composer', 'performer'))
+            self.assertEqual([self.tracks[4]], list(result))
+
+            result = schema.lookup(c, Ref.ARTIST, self.artists[1].uri,
+                                   role='artist')
+            self.assertEqual([], list(result))
+
+    def test_lookup_many(self):
+        with self.connection as c:
+            uris = [track.uri for track in self.tracks]
+            self.assertEqual(
+                dict(zip(uris, [[track] for track in self.tracks])),
+                schema.lookup_many(c, Ref.TRACK, uris)
+            )
+            self.assertEqual({
+                self.albums[0].uri: [self.tracks[2]],
+                self.albums[2].uri: [self.tracks[4]],
+                'local:album:x': []
+            }, schema.lookup_many(c, Ref.ALBUM, [
+                self.albums[0].uri, self.albums[2].uri, 'local:album:x'
+            ]))
+            self.assertEqual({
+                self.artists[0].uri: [self.tracks[1], self.tracks[3]],
+                self.artists[1].uri: [self.tracks[4]]
+            }, schema.lookup_many(c, Ref.ARTIST, [
+                artist.uri for artist in self.artists
+            ]))
+
     def test_indexed_search(self):
         for results, query, filters in [
             (
@@ -156,11 +272,64 @@ class SchemaTest(unittest.TestCase):
                 [('track_name', 'track')],
                 [{'artist': self.artists[0].uri}, {'albumartist': self.artists[0].uri}]  # noqa
             ),
+            (
+                map(lambda t: t.uri, self.tracks),
+                [('track_name', 'tra')],
+                []
+            ),
+            (
+                [self.tracks[2].uri],
+                [('album', 'alb #0')],
+                []
+            ),
+            (
+                [],
+                [('track_name', '"*-')],
+                []
+            ),
         ]:
             with self.connection as c:
                 tracks = schema.search_tracks(c, query, 10, 0, False, filters)
             self.assertItemsEqual(results, map(lambda t: t.uri, tracks))
 
+    def test_fulltext_rank(self):
+        track = Track(uri='local:track:5', name='rock rock rock', genre='Pop')
+        schema.insert_track(self.connection, track)
+        with self.connection as c:
+            tracks = schema.search_tracks(c, [('any', 'rock')], 10, 0, False)
+        self.assertEqual(
+            [track.uri, self.tracks[0].uri], [t.uri for t in tracks]
+        )
+
+    def test_bulk(self):
+        c = self.connection
+        query = [('track_name', 'track')]
+        schema.begin_bulk(c)
+        schema.delete_track(c, self.tracks[0].uri)
+        # track with the highest key, which must not be reused
+        schema.delete_track(c, self.tracks[-1].uri)
+        schema.insert_track(c, Track(uri='local:track:5', name='track #5'))
+        schema.insert_track(c, self.tracks[1].copy(name='renamed'))
+        self.assertItemsEqual(
+            [track.uri for track in self.tracks[2:-1]],
+            [t.uri for t in schema.search_tracks(c, query, 10, 0, False)]
+        )
+        schema.end_bulk(c)
+        self.assertItemsEqual(
+            [track.uri for track in self.tracks[2:-1]] + ['local:track:5'],
+            [t.uri for t in schema.search_tracks(c, query, 10, 0, False)]
+        )
+        self.assertEqual([], schema.search_tracks(
+            c, [('track_name', self.tracks[-1].name)], 10, 0, True
+        ))
+        self.assertEqual(['local:track:5'], [
+            t.uri for t in schema.search_tracks(
+                c, [('track_name', 'track #5')], 10, 0, True
+            )
+        ])
+        schema.insert_track(c, Track(uri='local:track:6', name='track #6'))
+        self.assertEqual(4, len(schema.search_tracks(c, query, 10, 0, False)))
+
     def test_browse_artists(self):
         def ref(artist):
             return Ref.artist(name=artist.name, uri=artist.uri)
@@ -199,6 +368,22 @@ class SchemaTest(unittest.TestCase):
             self.assertEqual(map(ref, self.albums[1:2]), schema.browse(
                 c, Ref.ALBUM, albumartist=self.artists[0].uri
             ))
+            self.assertEqual(map(ref, self.albums[2:3]), schema.browse(
+                c, Ref.ALBUM, composer=self.artists[0].uri
+            ))
+        # changing album artists updates links of existing tracks
+        schema.insert_album(self.connection, self.albums[1].copy(
+            artists=[self.artists[1]]
+        ))
+        with self.connection as c:
+            self.assertEqual(map(ref, self.albums[1:3]), schema.browse(
+                c, Ref.ALBUM, albumartist=self.artists[1].uri
+            ))
+            self.assertEqual([self.tracks[3].uri, self.tracks[4].uri], [
+                track.uri for track in schema.search_tracks(
+                    c, [], 10, 0, False, [{'albumartist': self.artists[1].uri}]
+                )
+            ])
 
     def test_browse_tracks(self):
         def ref(track):
@@ -222,6 +407,98 @@ class SchemaTest(unittest.TestCase):
                 performer=self.artists[0].uri
             ))
 
+    def test_browse_paginated(self):
+        def ref(track):
+            return Ref.track(name=track.name, uri=track.uri)
+
+        with self.connection as c:
+            self.assertEqual(map(ref, self.tracks[0:2]), schema.browse(
+                c, Ref.TRACK, limit=2
+            ))
+            self.assertEqual(map(ref, self.tracks[2:4]), schema.browse(
+                c, Ref.TRACK, limit=2, after=self.tracks[1].uri
+            ))
+            self.assertEqual(map(ref, self.tracks[4:5]), schema.browse(
+                c, Ref.TRACK, limit=2, after=self.tracks[3].uri
+            ))
+            self.assertEqual(map(ref, self.tracks[2:3]), schema.browse(
+                c, Ref.TRACK, after=self.tracks[1].uri,
+                album=self.albums[0].uri
+            ))
+
+    def test_browse_sorted(self):
+        artists = [
+            Artist(uri='local:artist:c', name='Cream'),
+            Artist(uri='local:artist:b', name='The Beatles'),
+            Artist(uri='local:artist:a', name='\xc1BBA'),
+            Artist(uri='local:artist:d', name='Jim Morrison',
+                   sortname='Morrison, Jim'),
+            Artist(uri='local:artist:e', name='Led Zeppelin')
+        ]
+        schema.clear(self.connection)
+        schema.insert_artists(self.connection, artists)
+        with self.connection as c:
+            self.assertEqual('abcde', ''.join(
+                ref.uri[-1] for ref in schema.browse(c, Ref.ARTIST)
+            ))
+            self.assertEqual('abced', ''.join(
+                ref.uri[-1] for ref in schema.browse(
+                    c, Ref.ARTIST, order=('sortname_key',)
+                )
+            ))
+        self.assertEqual('abba', schema.sortkey('\xc1BBA'))
+        self.assertEqual('beatles', schema.sortkey('The  Beatles'))
+        self.assertEqual('a-ha', schema.sortkey('A-ha'))
+        self.assertEqual('the', schema.sortkey('The'))
+        self.assertEqual('who', schema.sortkey(b'The Who'))
+
+    def test_browse_plan(self):
+        c = self.connection
+        statements = []
+        c.trace = lambda sql, params: statements.append((sql, params))
+        for kwargs in [{}, {'limit': 2}, {'limit': 2, 'after': 'x'}]:
+            schema.browse(c, Ref.ALBUM, **kwargs)
+        c.trace = None
+        # album browse queries are ordered by index, paginated or not
+        for sql, params in statements:
+            plan = '\n'.join(schema.explain(c, sql, params))
+            self.assertIn('USING INDEX album_sortkey_index', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_browse_dates(self):
+        c = self.connection
+        schema.insert_track(c, self.tracks[1].copy(date='2014'))
+        schema.insert_track(c, self.tracks[2].copy(album=self.albums[0].copy(
+            date='2015-03'
+        )))
+
+        def uris(refs):
+            return [ref.uri for ref in refs]
+
+        with c:
+            self.assertEqual(['2014', '2015-03', '2015-03-15'], list(
+                schema.dates(c)
+            ))
+            self.assertEqual(['2014', '2015'], list(
+                schema.dates(c, format='%Y')
+            ))
+            self.assertEqual(['local:track:0', 'local:track:2'], uris(
+                schema.browse(c, Ref.TRACK, date='2015')
+            ))
+            self.assertEqual(['local:track:0'], uris(
+                schema.browse(c, Ref.TRACK, date='2015-03-1')
+            ))
+            self.assertEqual(['local:album:0'], uris(
+                schema.browse(c, Ref.ALBUM, date='2015-03')
+            ))
+            self.assertEqual(['local:track:1'], uris(
+                schema.browse(c, date='2014')
+            ))
+            self.assertEqual([], uris(schema.browse(c, date='2015/03')))
+            self.assertEqual(['local:track:2'], uris(schema.search_tracks(
+                c, [], 10, 0, False, [{'date': '2015-03', 'album': 'local:album:0'}]  # noqa
+            )))
+
     def test_delete(self):
         c = self.connection
         schema.delete_track(c, self.tracks[0].uri)
@@ -248,3 +525,157 @@ class SchemaTest(unittest.TestCase):
         schema.cleanup(c)
         self.assertEqual(0, len(c.execute('SELECT * FROM album').fetchall()))
         self.assertEqual(0, len(c.execute('SELECT * FROM artist').fetchall()))
+
+    def test_cleanup_replace(self):
+        c = self.connection
+        artist = Artist(uri='local:artist:2', name='artist #2')
+        album = Album(uri='local:album:3', name='album #3', artists=[artist])
+        schema.insert_track(c, self.tracks[4].copy(
+            album=album, composers=[], performers=[]
+        ))
+        schema.cleanup(c)
+        self.assertEqual(
+            ['local:album:0', 'local:album:1', 'local:album:3'],
+            [row.uri for row in c.execute('SELECT uri FROM album')]
+        )
+        self.assertEqual(
+            ['local:artist:0', 'local:artist:2'],
+            [row.uri for row in c.execute('SELECT uri FROM artist')]
+        )
+        self.assertEqual([], c.execute('SELECT * FROM dirty').fetchall())
+
+    def test_optimize(self):
+        c = self.connection
+        schema.optimize(c, 0)
+        schema.optimize(c, len(self.tracks))
+        self.assertIn('track', [
+            row.tbl for row in c.execute('SELECT tbl FROM sqlite_stat1')
+        ])
+
+    def test_summaries(self):
+        c = self.connection
+        queries = [
+            'SELECT * FROM genre_count ORDER BY genre',
+            'SELECT * FROM date_count ORDER BY datekey',
+            """
+            SELECT role, uri, count
+              FROM artist_role JOIN artist ON artist_role.artist = artist.id
+             ORDER BY role, uri
+            """,
+        ]
+
+        def summaries():
+            return [map(tuple, c.execute(sql)) for sql in queries]
+
+        schema.insert_track(c, self.tracks[1].copy(genre='Jazz'))
+        schema.insert_track(c, self.tracks[3].copy(date='2015-03-15'))
+        schema.delete_track(c, self.tracks[4].uri)
+        schema.cleanup(c)
+        result = summaries()
+        self.assertEqual([
+            [('Jazz', 1), ('Rock', 1)],
+            [(20150315, 2)],
+            [('albumartist', 'local:artist:0', 1), ('artist', 'local:artist:0', 1)]  # noqa
+        ], result)
+        schema.update_summaries(c)
+        self.assertEqual(result, summaries())
+
+    def test_multiple_artists(self):
+        c = self.connection
+        artists = [
+            Artist(uri='local:artist:2', name='artist #2'),
+            Artist(uri='local:artist:3', name='artist #3'),
+        ]
+        album = Album(uri='local:album:3', name='album #3', artists=artists)
+        track = Track(uri='local:track:5', name='track #5', album=album,
+                      artists=artists, composers=artists[:1])
+        schema.insert_track(c, track)
+        self.assertEqual([track], list(schema.lookup(c, Ref.TRACK, track.uri)))
+        # second artist and album artist
+        self.assertEqual(2, c.execute(
+            'SELECT extra_artists FROM track WHERE uri = ?', [track.uri]
+        ).fetchone()[0])
+        for artist in artists:
+            self.assertEqual([track], schema.search_tracks(
+                c, [('artist', artist.name)], 10, 0, True
+            ))
+            self.assertEqual([track], schema.search_tracks(
+                c, [('albumartist', artist.name)], 10, 0, False
+            ))
+            self.assertEqual([Ref.album(uri=album.uri, name=album.name)], (
+                schema.browse(c, Ref.ALBUM, artist=artist.uri)
+            ))
+            self.assertEqual([Ref.track(uri=track.uri, name=track.name)], (
+                schema.browse(c, Ref.TRACK, albumartist=artist.uri)
+            ))
+        self.assertEqual(
+            {'artist #0', 'artist #1', 'artist #2', 'artist #3'},
+            set(schema.list_distinct(c, 'albumartist'))
+        )
+        self.assertEqual(
+            {'artist #2', 'artist #3'},
+            set(schema.list_distinct(c, 'artist', [('album', album.name)]))
+        )
+        self.assertEqual(
+            ['local:artist:0', 'local:artist:2'],
+            [ref.uri for ref in schema.browse(c, Ref.ARTIST, role='composer')]
+        )
+        # dropping an artist orphans it
+        schema.insert_track(c, track.copy(artists=artists[:1]))
+        self.assertEqual(1, c.execute(
+            'SELECT extra_artists FROM track WHERE uri = ?', [track.uri]
+        ).fetchone()[0])
+        schema.cleanup(c)
+        self.assertEqual(
+            [track.copy(artists=artists[:1])],
+            list(schema.lookup(c, Ref.TRACK, track.uri))
+        )
+        self.assertEqual([], schema.search_tracks(
+            c, [('artist', artists[1].name)], 10, 0, True
+        ))
+        self.assertEqual(2, len(schema.browse(c, Ref.ARTIST, role='artist')))
+
+    def test_migrate(self):
+        c = sqlite3.connect(DBPATH, factory=schema.Connection)
+        # v1 library tables, without artist sortname
+        c.executescript("""
+        PRAGMA user_version = 1;
+        CREATE TABLE artist (uri TEXT PRIMARY KEY, name TEXT NOT NULL,
+                             musicbrainz_id TEXT);
+        CREATE TABLE album (uri TEXT PRIMARY KEY, name TEXT NOT NULL,
+                            artists TEXT, num_tracks INTEGER,
+                            num_discs INTEGER, date TEXT,
+                            musicbrainz_id TEXT, images TEXT);
+        CREATE TABLE track (uri TEXT PRIMARY KEY, name TEXT NOT NULL,
+                            album TEXT, artists TEXT, composers TEXT,
+                            performers TEXT, genre TEXT, track_no INTEGER,
+                            disc_no INTEGER, date TEXT, length INTEGER,
+                            bitrate INTEGER, comment TEXT,
+                            musicbrainz_id TEXT, last_modified INTEGER);
+        CREATE VIEW tracks AS SELECT * FROM track;
+        INSERT INTO artist VALUES ('local:artist:0', 'artist #0', NULL);
+        INSERT INTO album VALUES ('local:album:1', 'album #1',
+                                  'local:artist:0', NULL, NULL, NULL,
+                                  NULL, NULL);
+        INSERT INTO track (uri, name, album, artists)
+        VALUES ('local:track:3', 'track #3', 'local:album:1',
+                'local:artist:0');
+        """)
+        self.assertEqual(schema.schema_version, schema.load(c))
+        track = self.tracks[3].copy(artists=[self.artists[0]])
+        self.assertEqual([track], list(schema.tracks(c)))
+        self.assertEqual([track.uri], [t.uri for t in schema.search_tracks(
+            c, [('any', 'artist')], 10, 0, False
+        )])
+        self.assertEqual([track.uri], [t.uri for t in schema.search_tracks(
+            c, [('albumartist', 'artist #0')], 10, 0, True
+        )])
+        self.assertEqual(
+            [Ref.artist(uri='local:artist:0', name='artist #0')],
+            schema.browse(c, Ref.ARTIST, role='albumartist')
+        )
+        self.assertEqual(
+            [Ref.album(uri='local:album:1', name='album #1')],
+            schema.suggest(c, 'alb', 10)
+        )
+        c.close()
@@ -0,0 +1,42 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from mopidy_local_sqlite import stats
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_measure(self):
+        s = stats.Stats()
+        with s.measure('search') as sample:
+            s.step()
+            s.trace('SELECT 1')
+            sample.rows = 2
+        s.step()  # not measured
+        self.assertEqual(1, sample.steps)
+        self.assertEqual([('SELECT 1', ())], sample.statements)
+        self.assertGreaterEqual(sample.ms, 0)
+        [(name, counter)] = list(s)
+        self.assertEqual('search', name)
+        self.assertEqual(1, counter.count)
+        self.assertEqual(2, counter.rows)
+        self.assertEqual(1, counter.steps)
+        self.assertEqual(1, sum(counter.histogram))
+
+    def test_histogram(self):
+        c = stats.Counter()
+        for ms in (0.5, 1, 3, 10000):
+            c.add(ms, 0, 0)
+        self.assertEqual(2, c.histogram[0])
+        self.assertEqual(1, c.histogram[2])
+        self.assertEqual(1, c.histogram[-1])
+        self.assertIn('<=1:2 <=5:1 >5000:1', str(c))
+
+    def test_clear(self):
+        s = stats.Stats()
+        with s.measure('browse'):
+            pass
+        self.assertEqual(1, len(s))
+        s.clear()
+        self.assertEqual(0, len(s))